@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+from cachetools import TTLCache
+from redisvl.utils.vectorize import BaseVectorizer
+
+# In-process tier, shared by every session of the streamlit server
+_local = TTLCache(maxsize=1024, ttl=3600)
+_local_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class CachedVectorizer(BaseVectorizer):
+    """Two-tier embedding cache in front of another vectorizer.
+
+    Lookups go to an in-process LRU first, then to Redis, where each entry is
+    a hash under embcache:{model}:{sha256 of the normalized text} with a TTL.
+    A sorted set of last-access times caps the Redis tier at max_entries,
+    the least recently used entries are evicted first. Only misses reach the
+    wrapped vectorizer.
+    """
+
+    vectorizer: Any
+    redis_client: Any
+    ttl: Optional[int]
+    max_entries: int
+
+    def __init__(
+        self,
+        vectorizer: BaseVectorizer,
+        redis_client,
+        ttl: Optional[int] = None,
+        max_entries: Optional[int] = None,
+    ):
+        super().__init__(
+            model=vectorizer.model,
+            dims=vectorizer.dims,
+            client=vectorizer.client,
+            vectorizer=vectorizer,
+            redis_client=redis_client,
+            ttl=ttl or int(os.getenv("embedding_cache_ttl", 7 * 24 * 3600)),
+            max_entries=max_entries
+            or int(os.getenv("embedding_cache_max_entries", 100000)),
+        )
+
+    @property
+    def _prefix(self) -> str:
+        return f"embcache:{self.model}"
+
+    def _get(self, digests: List[str]) -> List[Optional[List[float]]]:
+        with _local_lock:
+            found = [_local.get((self.model, d)) for d in digests]
+        missing = [d for d, v in zip(digests, found) if v is None]
+        if not missing:
+            return found
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for d in missing:
+            pipe.hget(f"{self._prefix}:{d}", "vector")
+        from_redis = dict(zip(missing, pipe.execute()))
+
+        hits = {}
+        for i, d in enumerate(digests):
+            if found[i] is None and from_redis[d]:
+                raw = base64.b64decode(from_redis[d])
+                found[i] = np.frombuffer(raw, dtype=np.float32).tolist()
+                hits[d] = found[i]
+        if hits:
+            with _local_lock:
+                for d, vector in hits.items():
+                    _local[(self.model, d)] = vector
+            self.redis_client.zadd(
+                f"{self._prefix}:lru", {d: time.time() for d in hits}
+            )
+        return found
+
+    def _set(self, vectors: dict):
+        with _local_lock:
+            for d, vector in vectors.items():
+                _local[(self.model, d)] = vector
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for d, vector in vectors.items():
+            key = f"{self._prefix}:{d}"
+            raw = np.array(vector, dtype=np.float32).tobytes()
+            pipe.hset(key, "vector", base64.b64encode(raw).decode("ascii"))
+            pipe.expire(key, self.ttl)
+        pipe.zadd(f"{self._prefix}:lru", {d: time.time() for d in vectors})
+        pipe.zcard(f"{self._prefix}:lru")
+        size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            evicted = self.redis_client.zpopmin(
+                f"{self._prefix}:lru", size - self.max_entries
+            )
+            if evicted:
+                self.redis_client.delete(*[f"{self._prefix}:{d}" for d, _ in evicted])
+
+    def embed(
+        self,
+        text: str,
+        preprocess: Optional[Callable] = None,
+        as_buffer: bool = False,
+        **kwargs,
+    ) -> List[float]:
+        return self.embed_many([text], preprocess=preprocess, as_buffer=as_buffer)[0]
+
+    def embed_many(
+        self,
+        texts: List[str],
+        preprocess: Optional[Callable] = None,
+        batch_size: int = 10,
+        as_buffer: bool = False,
+        **kwargs,
+    ) -> List[List[float]]:
+        if preprocess:
+            texts = [preprocess(text) for text in texts]
+        digests = [text_digest(text) for text in texts]
+        vectors = self._get(digests)
+
+        # embed every distinct miss once, in as few upstream calls as possible
+        misses = {
+            d: normalize_text(t)
+            for d, t, v in zip(digests, texts, vectors)
+            if v is None
+        }
+        if misses:
+            embedded = self.vectorizer.embed_many(
+                list(misses.values()), batch_size=batch_size
+            )
+            fresh = dict(zip(misses, embedded))
+            self._set(fresh)
+            vectors = [
+                v if v is not None else fresh[d] for d, v in zip(digests, vectors)
+            ]
+
+        return [self._process_embedding(v, as_buffer) for v in vectors]
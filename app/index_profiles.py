@@ -0,0 +1,70 @@
+import os
+import yaml
+
+from redis.exceptions import ResponseError
+from redisvl.index import SearchIndex
+
+SCHEMA_FILE = "movie_index.yaml"
+VECTOR_FIELD = "embedding"
+
+
+def load_schema(path=SCHEMA_FILE, profile=None, **overrides) -> dict:
+    """Return the index schema with the vector field set up for `profile`.
+
+    The profile defaults to index_profile from app.config, and to the schema
+    as declared (flat) when that is not set either. Several profiles can be
+    given separated by commas. Extra keyword arguments override single vector
+    attributes, e.g. m=32 or ef_runtime=50.
+    """
+    with open(path) as f:
+        schema = yaml.safe_load(f)
+    profiles = schema.pop("profiles", {})
+    profile = profile or os.getenv("index_profile") or "flat"
+
+    # profiles can be combined and are applied in order, e.g. "hnsw,local"
+    field = next(f for f in schema["fields"] if f["name"] == VECTOR_FIELD)
+    for name in profile.split(","):
+        if name.strip() not in profiles:
+            raise ValueError(
+                f"Unknown index profile {name!r}, expected one of {list(profiles)}"
+            )
+        field["attrs"].update(profiles[name.strip()])
+    field["attrs"].update({k: v for k, v in overrides.items() if v is not None})
+
+    # not a redis attribute, the embeddings are projected to `dims` (see
+    # projection.py) before they are stored or searched
+    schema["projection"] = field["attrs"].pop("projection", None)
+    return schema
+
+
+def index_projection(path=SCHEMA_FILE, profile=None):
+    """The projection (e.g. "pca") the embeddings go through for `profile`,
+    None when they are stored as they are."""
+    return load_schema(path, profile)["projection"]
+
+
+def build_index(
+    path=SCHEMA_FILE, profile=None, name=None, prefix=None, **overrides
+) -> SearchIndex:
+    schema = load_schema(path, profile, **overrides)
+    if name:
+        schema["index"]["name"] = name
+    if prefix:
+        schema["index"]["prefix"] = prefix
+    return SearchIndex.from_dict(schema)
+
+
+def index_target(client, name):
+    """Return the name and key prefix of the index `name` refers to, following
+    it when it is an alias, or None when there is no such index.
+
+    `load_redis.py --mode rebuild` serves the movies under an alias of
+    versioned indexes, each over its own key prefix.
+    """
+    try:
+        info = client.ft(name).info()
+    except ResponseError:
+        return None
+    definition = info["index_definition"]
+    definition = dict(zip(definition[::2], definition[1::2]))
+    return info["index_name"], definition["prefixes"][0]
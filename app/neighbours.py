@@ -0,0 +1,80 @@
+import json
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Precomputed "more like this": every movie document carries its K most
+# similar movies as
+#   $.similar = [{"id": 862, "title": "Toy Story", "score": 0.93}, ...]
+# by cosine similarity of the embeddings, most similar first. The loader
+# computes them for every document it loads, Movie Maker adds new movies to
+# the lists of their neighbours as they are saved.
+
+DEFAULT_K = 10
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_neighbours(
+    vectors: np.ndarray, k: int, block_size: int = 1024
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """Yield the first row, and the rows and similarities of the `k` nearest
+    other rows of each row, for blocks of `block_size` rows of `vectors`.
+
+    Every block is compared with the rows `block_size` at a time, keeping a
+    running top k, so memory stays at block_size x (block_size + k)
+    similarities and `vectors` can be a memmap larger than RAM.
+    """
+    n = len(vectors)
+    k = min(k, n - 1)
+    for start in range(0, n, block_size):
+        block = normalize(vectors[start : start + block_size])
+        rows = np.empty((len(block), 0), dtype=np.int64)
+        scores = np.empty((len(block), 0), dtype=np.float32)
+        if k <= 0:
+            yield start, rows, scores
+            continue
+        for other in range(0, n, block_size):
+            block_scores = block @ normalize(vectors[other : other + block_size]).T
+            if other == start:
+                # a movie is not its own neighbour
+                block_scores[np.arange(len(block)), np.arange(len(block))] = -np.inf
+            block_rows = np.broadcast_to(
+                np.arange(other, other + block_scores.shape[1]), block_scores.shape
+            )
+            scores = np.concatenate([scores, block_scores], axis=1)
+            rows = np.concatenate([rows, block_rows], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")
+        yield start, np.take_along_axis(rows, order, axis=1), np.take_along_axis(
+            scores, order, axis=1
+        )
+
+
+def entry(doc_id, title, score) -> dict:
+    return {"id": doc_id, "title": title, "score": round(float(score), 4)}
+
+
+def insert(similar: List[dict], new: dict, k: int) -> Optional[List[dict]]:
+    """`similar` with `new` in its place by score, None when it does not make
+    the top `k`."""
+    similar = [s for s in similar if s["id"] != new["id"]]
+    if len(similar) >= k and new["score"] <= similar[k - 1]["score"]:
+        return None
+    similar.append(new)
+    similar.sort(key=lambda s: -s["score"])
+    return similar[:k]
+
+
+def parse(value) -> List[dict]:
+    # $.similar as returned by FT.SEARCH, a JSON string of the list
+    if not value:
+        return []
+    return json.loads(value) if isinstance(value, str) else value
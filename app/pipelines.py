@@ -0,0 +1,491 @@
+import base64
+import random
+import time
+
+from redisvl.query import VectorQuery
+from rich import print
+
+from index_profiles import index_target
+from neighbours import DEFAULT_K, entry, insert, parse
+from planner import Predicate, load_stats, plan
+from prompt_cache import prompt_digest
+from resources import (
+    get_executor,
+    get_index,
+    get_llmcache,
+    get_openai_client,
+    get_poster_store,
+    get_redis_conn,
+    get_replica,
+    get_result_cache,
+    get_single_flight,
+    get_vectorizer,
+)
+from result_cache import bump_version
+from search import json_mget, knn, query_many
+from shards import RoutedPipeline, ShardedIndex, key_id
+from streaming_json import StreamingJSON
+from titles import add_title, dictionary_key, match_title, title_only
+from tracing import count, current_page, mark, mean_seconds, span, submit
+
+# The request handling of every page, without any streamlit calls, so the
+# pages and utils/bench_app.py run exactly the same code.
+
+DEFAULT_OVERVIEW = (
+    "Action packed movie where Ethan Hunt and team pulls off impossible missions"
+)
+
+# what the Recommendations list renders, the heavy fields are only fetched
+# for the results that get expanded
+RECOMMEND_FIELDS = [
+    "id",
+    "original_title",
+    "genres",
+    "popularity",
+    "runtime",
+    "tagline",
+    "budget",
+    "revenue",
+    "vote_count",
+    "vote_average",
+]
+DETAIL_FIELDS = ["overview", "original_language", "similar"]
+FIND_FIELDS = ["original_title", "overview", "tagline"]
+
+
+def movie_markdown(doc) -> str:
+    return f"""
+        ### {doc["original_title"]}
+        **_{doc["tagline"] if doc["tagline"] else 'NA'}_**  
+        *{doc["overview"]}*
+        """
+
+
+def title_match(prompt, fields) -> list:
+    """The `fields` of the movies titled `prompt`, read without an embedding
+    or a KNN search; empty unless the prompt is a whole title (titles.py).
+    They only replace the search when title_only(prompt)."""
+    jindex, r = get_index(), get_redis_conn()
+    start = time.perf_counter()
+    with span("title_lookup"):
+        keys = match_title(r, dictionary_key(jindex.name), prompt)
+        docs = []
+        if keys:
+            source = jindex if isinstance(jindex, ShardedIndex) else r
+            values = json_mget(source, keys, fields)
+            docs = [
+                {"id": key, **{field: values[field][n] for field in fields}}
+                for n, key in enumerate(keys)
+            ]
+            # gone since the dictionary was built
+            docs = [doc for doc in docs if doc[fields[0]] is not None]
+
+    page, skips = current_page(), bool(docs) and title_only(prompt)
+    # a merged match is shown first, above the search results
+    result = "hit" if skips else "merged" if docs else "miss"
+    count("title_lookups", page=page, result=result)
+    if skips:
+        # what the embedding and the search have taken on this page so far
+        skipped = mean_seconds(page, "embed") + mean_seconds(page, "knn_search")
+        saved = max(skipped - (time.perf_counter() - start), 0.0)
+        count("title_saved_seconds", saved, page=page)
+    return docs
+
+
+# Find My Movies
+def find_query(vector, num_results=3) -> VectorQuery:
+    return VectorQuery(
+        vector=vector,
+        vector_field_name="embedding",
+        return_fields=FIND_FIELDS,
+        num_results=num_results,
+    )
+
+
+def find_movies(prompt) -> str:
+    titled = title_match(prompt, FIND_FIELDS)
+    if titled and title_only(prompt):
+        return "".join(movie_markdown(doc) for doc in titled)
+
+    oai, jindex, replica = get_vectorizer(), get_index(), get_replica()
+    with span("embed"):
+        prompt_vector_embedding = oai.embed(text=prompt)
+    q = find_query(prompt_vector_embedding)
+    with span("knn_search"):
+        docs = knn(jindex, [q], replica, get_result_cache())[0]
+    # the movie of that title first, then the closest others
+    keys = {doc["id"] for doc in titled}
+    merged = titled + [doc for doc in docs if doc["id"] not in keys]
+    merged = merged[: max(len(docs), len(titled))]
+    return "".join(movie_markdown(doc) for doc in merged)
+
+
+# Semantic Caching
+def poster_response(prompt):
+    """Return the poster response for `prompt` and whether it came from the
+    semantic cache, or from the computation of a concurrent request."""
+    llmcache = get_llmcache()
+
+    # A prompt asked before verbatim is answered before anything is embedded
+    with span("cache_exact"):
+        cached = llmcache.check_exact(prompt)
+    if cached:
+        return cached, True
+
+    # Misses of the same prompt at the same time, from any session or
+    # process, share one computation
+    (response, cached), shared = get_single_flight().do(
+        prompt_digest(prompt), lambda: poster_miss(prompt)
+    )
+    return response, cached or shared
+
+
+def poster_miss(prompt):
+    """Return the poster response for `prompt`, missing the exact tier, and
+    whether it came from the semantic tier."""
+    oai, jindex, replica = get_vectorizer(), get_index(), get_replica()
+    llmcache = get_llmcache()
+
+    # A prompt that is clearly a movie title is answered with that movie,
+    # with no embedding, and only the exact tier can hold it
+    if title_only(prompt) and (
+        docs := title_match(prompt, ["original_title", "overview", "tagline"])
+    ):
+        response = poster_markdown(docs[0])
+        with span("cache_store"):
+            llmcache.store_exact(prompt, response)
+        return response, False
+
+    # The only embedding of this prompt, reused for the cache check, the
+    # movie search and the cache store
+    with span("embed"):
+        prompt_vector_embedding = oai.embed(text=prompt)
+
+    with span("cache_check"):
+        cached = llmcache.check(prompt, prompt_vector_embedding)
+    if cached:
+        return cached, True
+
+    q = VectorQuery(
+        vector=prompt_vector_embedding,
+        vector_field_name="embedding",
+        return_fields=["original_title", "overview", "tagline"],
+        num_results=1,
+    )
+    with span("knn_search"):
+        doc = knn(jindex, [q], replica)[0][0]
+
+    response = poster_markdown(doc)
+    with span("cache_store"):
+        llmcache.store(prompt, response, prompt_vector_embedding)
+    return response, False
+
+
+def poster_markdown(doc) -> str:
+    poster_url = make_poster(
+        "Please make sure the image contains NO text at all." + doc["overview"]
+    )
+    return f"""
+        <img src="{poster_url}" alt="drawing" width="512" height="512"/>
+
+        <br>  
+        {movie_markdown(doc)}"""
+
+
+def make_poster(image_prompt) -> str:
+    """Return the URL of the poster for `image_prompt`, generated only when
+    none is stored for it yet."""
+    client, store = get_openai_client(), get_poster_store()
+    with span("poster_lookup"):
+        url = store.get(image_prompt)
+    if url:
+        return url
+
+    # the image bytes come back with the response, there is no temporary URL
+    # to download or to expire
+    with span("image_generation"):
+        poster_image = client.images.generate(
+            model="dall-e-3",
+            prompt=image_prompt,
+            size="1024x1024",
+            quality="standard",
+            n=1,
+            response_format="b64_json",
+        )
+    with span("poster_store"):
+        return store.put(image_prompt, base64.b64decode(poster_image.data[0].b64_json))
+
+
+# Recommendations
+# slider -> the field it bounds and how, as labelled in the page
+RECOMMEND_FILTERS = {
+    "popularity_val": ("popularity", ">="),
+    "runtime_val": ("runtime", "<="),
+    "budget_val": ("budget", "<="),
+    "revenue_val": ("revenue", ">="),
+    "vote_count_val": ("vote_count", ">="),
+    "vote_avg_val": ("vote_average", ">="),
+}
+
+
+def make_predicates(genres=None, **filters) -> list:
+    predicates = [
+        Predicate(*RECOMMEND_FILTERS[name], value)
+        for name, value in filters.items()
+        if value is not None
+    ]
+    if genres and genres != "*":
+        predicates.append(Predicate("genres", "in", frozenset([genres.lower()])))
+    return predicates
+
+
+def plan_recommendation(jindex, genres="*", num_results=3, **filters):
+    with span("plan"):
+        predicates = make_predicates(genres=genres, **filters)
+        return plan(load_stats(jindex), predicates, num_results)
+
+
+def recommend_query(vector, query_plan) -> VectorQuery:
+    return VectorQuery(
+        vector,
+        "embedding",
+        return_fields=query_plan.return_fields(RECOMMEND_FIELDS),
+        filter_expression=(
+            query_plan.filter_expression()
+            if query_plan.strategy == "prefilter"
+            else None
+        ),
+        num_results=query_plan.num_results,
+    )
+
+
+def recommend_many(vectors, plans, num_results, cache=None):
+    """Run the planned Recommendations query of every vector in one pipelined
+    round trip, plus one for the post-filtered queries left short of
+    `num_results`. Return the query, results and plan of each, in order."""
+    jindex, replica = get_index(), get_replica()
+    queries = [recommend_query(v, p) for v, p in zip(vectors, plans)]
+    with span("knn_search"):
+        results = knn(jindex, queries, replica, cache)
+    results = [p.apply(docs, k) for p, docs, k in zip(plans, results, num_results)]
+
+    # too few candidates survived the post-filter, let Redis filter instead
+    short = [
+        i
+        for i, (p, docs, k) in enumerate(zip(plans, results, num_results))
+        if p.strategy == "postfilter" and len(docs) < k
+    ]
+    if short:
+        plans = list(plans)
+        for i in short:
+            plans[i] = plans[i].as_prefilter(num_results[i])
+            print(f"Recommendations plan: fell back to {plans[i]}")
+            queries[i] = recommend_query(vectors[i], plans[i])
+        with span("knn_search"):
+            refetched = knn(jindex, [queries[i] for i in short], replica, cache)
+        for i, docs in zip(short, refetched):
+            results[i] = docs
+    return list(zip(queries, results, plans))
+
+
+def recommend(overview, genres="*", num_results=3, **filters):
+    """Return the query issued, the movies matching `overview` and the
+    slider values in `filters`, and the plan the query was run with."""
+    oai, jindex = get_vectorizer(), get_index()
+    with span("embed"):
+        overview_embedding = oai.embed(text=overview or DEFAULT_OVERVIEW)
+
+    query_plan = plan_recommendation(jindex, genres, num_results, **filters)
+    print(f"Recommendations plan: {query_plan}")
+    return recommend_many(
+        [overview_embedding], [query_plan], [num_results], get_result_cache()
+    )[0]
+
+
+def movie_details(ids) -> dict:
+    """Return the DETAIL_FIELDS of the movies `ids`, by id. The ids of search
+    results are the keys of the documents."""
+    jindex = get_index()
+    with span("details"):
+        source = jindex if isinstance(jindex, ShardedIndex) else get_redis_conn()
+        values = json_mget(source, list(ids), DETAIL_FIELDS)
+    return {
+        i: {field: values[field][n] for field in DETAIL_FIELDS}
+        for n, i in enumerate(ids)
+    }
+
+
+# Movie Maker
+def match_plotlines(plotlines):
+    """Return the overview of the closest movie to each plotline, and the
+    plotline embeddings."""
+    # one batched embedding call and one pipelined round trip for all the
+    # KNN searches, however many plotlines there are
+    oai, jindex, replica = get_vectorizer(), get_index(), get_replica()
+    plotlines = [p for p in plotlines if p.strip()]
+    with span("embed"):
+        embeddings = oai.embed_many(plotlines)
+    queries = [
+        VectorQuery(
+            embedding,
+            "embedding",
+            return_fields=["original_title", "overview"],
+            num_results=1,
+        )
+        for embedding in embeddings
+    ]
+    with span("knn_search"):
+        results = knn(jindex, queries, replica)
+    return [result[0]["overview"] for result in results], embeddings
+
+
+def movie_prompt(descriptions) -> str:
+    plots = ""
+    for i, doc in enumerate(descriptions):
+        plots += f"<br>Description {i+1}   <br>"
+        plots += doc + "  <br>"
+
+    co, cc = "{", "}"
+    return f"""
+                You are a expert story teller.  
+                You are given the below movie descriptions    
+                {plots}   
+                Your task is to generate a movie plot which combines the essence of  
+                all the above plotlines and generate a completely new story.  
+
+
+                The output should be a JSON document in the following format
+                {co}
+                    "original_title" : "title generated",
+                    "overview" : "overview generated",
+                    "genres" : [List of genres of the generated movie, all double quoted],
+                    "tagline" : "tagline of the movie",
+                    "poster_desc" : "poster description generated"
+                {cc}
+
+                The overview should be atleast 200 words.  
+                The poster description generated should be a simple image description  
+                which can be fed to AI Image generator for best results, no more than one line.
+                """
+
+
+def embed_overview(overview):
+    with span("embed"):
+        return get_vectorizer().embed(overview)
+
+
+def make_movie(augmented_prompt, on_update=None, embed=False):
+    """Return the generated movie document, the url of its poster and, with
+    `embed`, the embedding of its overview.
+
+    The completion is streamed: `on_update` is called with the fields parsed
+    so far as it comes in. The poster is generated as soon as poster_desc is
+    complete and the overview embedded as soon as it is, both on the shared
+    executor while the rest of the completion streams in.
+    """
+    client, executor = get_openai_client(), get_executor()
+    parser = StreamingJSON()
+    poster = embedding = None
+    with span("chat_completion"):
+        stream = client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": augmented_prompt}],
+            temperature=0,
+            stream=True,
+        )
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            parser.feed(chunk.choices[0].delta.content)
+            fields = parser.fields
+            if poster is None and "poster_desc" in fields:
+                poster = submit(executor, make_poster, fields["poster_desc"])
+            if embed and embedding is None and "overview" in fields:
+                embedding = submit(executor, embed_overview, fields["overview"])
+            if on_update and (partial := parser.partial()):
+                mark("first_content")
+                on_update(partial)
+
+    if not parser.done:
+        raise ValueError(f"Incomplete movie document: {parser.text!r}")
+    payload = parser.fields
+    if poster is None:
+        poster = submit(executor, make_poster, payload["poster_desc"])
+    if embed and embedding is None:
+        embedding = submit(executor, embed_overview, payload["overview"])
+    with span("wait"):
+        return (
+            payload,
+            poster.result(),
+            embedding.result() if embedding is not None else None,
+        )
+
+
+def save_movie(payload, embedding) -> str:
+    gen_movie_id = random.randint(500000, 1000000)
+    add_movie = {
+        "id": gen_movie_id,
+        "original_title": payload["original_title"],
+        "original_language": "en",
+        "overview": payload["overview"],
+        "genres": payload["genres"],
+        "popularity": 0.0,
+        "runtime": 120,
+        "tagline": payload["tagline"],
+        "budget": 0,
+        "revenue": 0,
+        "vote_count": 0,
+        "vote_average": 10.0,
+        # the embedding of the generated overview, from make_movie(embed=True)
+        "embedding": embedding,
+    }
+    jindex, r = get_index(), get_redis_conn()
+    with span("neighbours"):
+        # on the primary, the replica does not have the lists of neighbours
+        q = VectorQuery(
+            vector=embedding,
+            vector_field_name="embedding",
+            return_fields=["original_title", "$.similar"],
+            num_results=DEFAULT_K,
+        )
+        docs = query_many(jindex, [q])[0]
+        lists = [parse(doc.get("$.similar")) for doc in docs]
+        k = max((len(similar) for similar in lists), default=0) or DEFAULT_K
+        similar = [
+            entry(
+                int(key_id(doc["id"])),
+                doc["original_title"],
+                1.0 - float(doc["vector_distance"]),
+            )
+            for doc in docs
+        ]
+        add_movie["similar"] = similar[:k]
+    with span("save"):
+        # the key prefix changes with every rebuild behind the index alias
+        _, prefix = index_target(jindex.client, jindex.name) or (None, jindex.prefix)
+        key = f"{prefix}:{gen_movie_id}"
+        # the new movie, its place in the lists of its neighbours and the
+        # version bump that retires cached results go in together, on a
+        # single node. Two movies saved at once next to the same neighbour
+        # can each miss the other's update of its list, the next load
+        # recomputes them all.
+        pipe = RoutedPipeline(jindex, transaction=True)
+        pipe.route(gen_movie_id).json().set(key, "$", obj=add_movie)
+        new = entry(gen_movie_id, payload["original_title"], 0.0)
+        for doc, neighbour, others in zip(docs, similar, lists):
+            updated = insert(others, dict(new, score=neighbour["score"]), k)
+            if updated is not None:
+                pipe.route(key_id(doc["id"])).json().set(
+                    doc["id"], "$.similar", updated
+                )
+        if isinstance(jindex, ShardedIndex):
+            # the result version is on redis_host, bumped once the shards
+            # have the writes
+            pipe.execute()
+            bump_version(r)
+        else:
+            bump_version(pipe.route(gen_movie_id))
+            pipe.execute()
+        # its title goes straight to the movie from now on
+        add_title(r, dictionary_key(jindex.name), payload["original_title"], key)
+    return key
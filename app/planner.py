@@ -0,0 +1,197 @@
+import json
+import math
+import os
+import threading
+from typing import Any, List, NamedTuple, Optional
+
+import numpy as np
+from cachetools import TTLCache
+from redis.commands.search import reducers
+from redis.commands.search.aggregation import AggregateRequest
+from redis.commands.search.query import Query
+from redisvl.query.filter import FilterExpression, Num, Tag
+
+# Cost-based planning of the filtered KNN searches of the Recommendations
+# page. Predicates at their neutral value are dropped, the selectivity of the
+# rest is estimated from per-field quantiles and tag counts, and the plan is
+# one of
+#   knn         nothing left to filter on
+#   prefilter   KNN over the documents matching the filter, done by Redis
+#   postfilter  plain KNN for more candidates than asked for, filtered here,
+#               when the filter keeps most documents anyway
+
+QUANTILES = [i / 20 for i in range(21)]
+OVERSAMPLE = 2
+
+_stats = TTLCache(maxsize=16, ttl=300)
+_stats_lock = threading.Lock()
+
+
+class Predicate(NamedTuple):
+    field: str
+    op: str  # ">=", "<=" or "in"
+    value: Any
+
+    def expression(self) -> FilterExpression:
+        if self.op == ">=":
+            return Num(self.field) >= self.value
+        if self.op == "<=":
+            return Num(self.field) <= self.value
+        return Tag(self.field) == sorted(self.value)
+
+    def matches(self, doc) -> bool:
+        value = doc.get(f"$.{self.field}") or doc.get(self.field)
+        if value is None or value == "":
+            return False
+        if self.op == "in":
+            tags = json.loads(value) if value.startswith("[") else [value]
+            return any(str(tag).lower() in self.value for tag in tags)
+        value = float(value)
+        return value >= self.value if self.op == ">=" else value <= self.value
+
+    def __str__(self) -> str:
+        if self.op == "in":
+            return f"{self.field} in {{{', '.join(sorted(self.value))}}}"
+        return f"{self.field} {self.op} {self.value}"
+
+
+class Plan:
+    def __init__(self, strategy, predicates, selectivity, num_results, dropped):
+        self.strategy = strategy
+        self.predicates = predicates
+        self.selectivity = selectivity
+        self.num_results = num_results
+        self.dropped = dropped
+
+    def as_prefilter(self, k) -> "Plan":
+        return Plan("prefilter", self.predicates, self.selectivity, k, self.dropped)
+
+    def filter_expression(self) -> Optional[FilterExpression]:
+        expression = None
+        for predicate in self.predicates:
+            expression = (
+                predicate.expression()
+                if expression is None
+                else expression & predicate.expression()
+            )
+        return expression
+
+    def return_fields(self, return_fields) -> List[str]:
+        # post-filtering needs every filtered field back, tags as the whole
+        # JSON array rather than the first value
+        if self.strategy != "postfilter":
+            return return_fields
+        extra = [
+            f"$.{p.field}" if p.op == "in" else p.field
+            for p in self.predicates
+            if (f"$.{p.field}" if p.op == "in" else p.field) not in return_fields
+        ]
+        return return_fields + extra
+
+    def apply(self, docs, k) -> list:
+        if self.strategy != "postfilter":
+            return docs
+        return [d for d in docs if all(p.matches(d) for p in self.predicates)][:k]
+
+    def __str__(self) -> str:
+        where = " and ".join(str(p) for p in self.predicates) or "-"
+        dropped = ", ".join(str(p) for p in self.dropped) or "-"
+        return (
+            f"{self.strategy} (k={self.num_results}, estimated selectivity "
+            f"{self.selectivity:.3f}) where {where}; dropped {dropped}"
+        )
+
+
+def load_stats(jindex) -> dict:
+    """Return the document count, the quantiles of every numeric field and
+    the document count of every tag value of `jindex`.
+
+    Computed with one FT.AGGREGATE plus one pipelined count query per tag
+    value, and cached in process and in Redis for planner_stats_ttl seconds.
+    """
+    with _stats_lock:
+        if stats := _stats.get(jindex.name):
+            return stats
+
+    client = jindex.client
+    key = f"planner:stats:{jindex.name}"
+    if cached := client.get(key):
+        stats = json.loads(cached)
+    else:
+        numeric = [f.name for f in jindex.schema.fields.values() if f.type == "numeric"]
+        tags = [f.name for f in jindex.schema.fields.values() if f.type == "tag"]
+
+        request = AggregateRequest("*").group_by(
+            [],
+            reducers.count().alias("count"),
+            *[
+                reducers.quantile(f"@{field}", q).alias(f"{field}_{i}")
+                for field in numeric
+                for i, q in enumerate(QUANTILES)
+            ],
+        )
+        row = client.ft(jindex.name).aggregate(request).rows[0]
+        values = dict(zip(row[::2], row[1::2]))
+        stats = {
+            "count": int(values["count"]),
+            "quantiles": {
+                field: [float(values[f"{field}_{i}"]) for i in range(len(QUANTILES))]
+                for field in numeric
+            },
+            "tags": {},
+        }
+
+        pipe = client.ft(jindex.name).pipeline(transaction=False)
+        tag_values = []
+        for field in tags:
+            for value in client.ft(jindex.name).tagvals(field):
+                tag_values.append((field, value))
+                query = Query(str(Tag(field) == value)).paging(0, 0).dialect(2)
+                pipe.search(query)
+        for (field, value), raw in zip(tag_values, pipe.execute()):
+            stats["tags"].setdefault(field, {})[value.lower()] = int(raw[0])
+
+        client.set(key, json.dumps(stats), ex=int(os.getenv("planner_stats_ttl", 3600)))
+
+    with _stats_lock:
+        _stats[jindex.name] = stats
+    return stats
+
+
+def selectivity(stats, predicate) -> float:
+    if predicate.op == "in":
+        counts = stats["tags"].get(predicate.field, {})
+        matched = sum(counts.get(tag, 0) for tag in predicate.value)
+        return min(matched / max(stats["count"], 1), 1.0)
+    quantiles = stats["quantiles"][predicate.field]
+    below = float(np.interp(predicate.value, quantiles, QUANTILES))
+    return 1.0 - below if predicate.op == ">=" else below
+
+
+def is_neutral(stats, predicate) -> bool:
+    if predicate.op == "in":
+        return not predicate.value
+    quantiles = stats["quantiles"].get(predicate.field)
+    if predicate.op == ">=":
+        return predicate.value is None or (
+            quantiles is not None and predicate.value <= quantiles[0]
+        )
+    # upper bounds at 0 are sliders left at their default, i.e. no limit
+    return not predicate.value or (
+        quantiles is not None and predicate.value >= quantiles[-1]
+    )
+
+
+def plan(stats, predicates, k) -> Plan:
+    dropped = [p for p in predicates if is_neutral(stats, p)]
+    kept = [p for p in predicates if not is_neutral(stats, p)]
+    estimate = math.prod(selectivity(stats, p) for p in kept)
+    if not kept:
+        return Plan("knn", kept, 1.0, k, dropped)
+
+    min_selectivity = float(os.getenv("planner_postfilter_selectivity", 0.3))
+    max_candidates = int(os.getenv("planner_max_candidates", 300))
+    candidates = math.ceil(k * OVERSAMPLE / max(estimate, 1e-9))
+    if estimate >= min_selectivity and candidates <= max_candidates:
+        return Plan("postfilter", kept, estimate, candidates, dropped)
+    return Plan("prefilter", kept, estimate, k, dropped)
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import re
+import threading
+from typing import Optional
+
+from embedding_cache import normalize_text
+
+# Served by streamlit at app/static/... with server.enableStaticServing
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+class PosterStore:
+    """Generated posters, stored once on local disk and looked up by prompt.
+
+    Image files are content addressed, {sha256 of the bytes}.png under
+    app/static/posters, so the same image is stored once however many prompts
+    produced it, and their URLs never expire. Redis maps posters:{sha256 of
+    the normalized image prompt} to the file. When the files add up to more
+    than max_bytes, the least recently used ones are deleted; a prompt whose
+    file is gone counts as a miss, and so does a cached answer linking to it
+    (see available()).
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        directory: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.redis_client = redis_client
+        # must be under STATIC_DIR to be served
+        self.directory = directory or os.path.join(STATIC_DIR, "posters")
+        self.max_bytes = max_bytes or int(
+            float(os.getenv("poster_store_max_mb", 1024)) * 1024 * 1024
+        )
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _key(self, prompt: str) -> str:
+        digest = hashlib.sha256(normalize_text(prompt).encode("utf-8")).hexdigest()
+        return f"posters:{digest}"
+
+    def url(self, name: str) -> str:
+        # relative to the page, which streamlit serves from the root
+        path = os.path.relpath(os.path.join(self.directory, name), STATIC_DIR)
+        return f"app/static/{path.replace(os.sep, '/')}"
+
+    def get(self, prompt: str) -> Optional[str]:
+        """The URL of the poster stored for `prompt`, None when there is none."""
+        name = self.redis_client.get(self._key(prompt))
+        if not name:
+            return None
+        return self.url(name) if self._touch(name) else None
+
+    def available(self, text: str) -> bool:
+        """Whether every poster `text` links to is still stored, marking them
+        as used."""
+        names = re.findall(r"\b([0-9a-f]{64}\.png)", text)
+        return all([self._touch(name) for name in names])
+
+    def _touch(self, name: str) -> bool:
+        try:
+            # eviction goes by the modification time, touched on every use
+            os.utime(os.path.join(self.directory, name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def put(self, prompt: str, image: bytes) -> str:
+        """Store the `image` generated for `prompt` and return its URL."""
+        name = f"{hashlib.sha256(image).hexdigest()}.png"
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(image)
+            os.replace(tmp, path)
+        self.redis_client.set(self._key(prompt), name)
+        self.evict()
+        return self.url(name)
+
+    def evict(self):
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
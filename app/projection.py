@@ -0,0 +1,170 @@
+import base64
+import hashlib
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+from redisvl.utils.vectorize import BaseVectorizer
+
+
+class Projection:
+    """Linear projection of embeddings onto fewer dimensions.
+
+    Fitted with a truncated SVD of a sample of the document embeddings, i.e.
+    PCA without centering, which keeps the dot products (and so the cosine
+    ranking) of the original vectors as well as any rank-k projection can.
+    The loader fits it and stores it in Redis next to the index, with a
+    fingerprint of the components, and the app loads it from there to
+    project query vectors the same way, again whenever the stored
+    fingerprint changes.
+    """
+
+    def __init__(self, components: np.ndarray):
+        # (dims_in, dims_out)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        # differs after every refit
+        self.fingerprint = hashlib.sha1(self.components.tobytes()).hexdigest()
+
+    @property
+    def dims_in(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def dims_out(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, sample: np.ndarray, dims: int) -> "Projection":
+        sample = np.asarray(sample, dtype=np.float32)
+        if dims >= sample.shape[1]:
+            raise ValueError(
+                f"Can not project {sample.shape[1]} dims onto {dims}, expected fewer"
+            )
+        _, _, vt = np.linalg.svd(sample, full_matrices=False)
+        return cls(vt[:dims].T)
+
+    def transform(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1] != self.dims_in:
+            raise ValueError(
+                f"Expected vectors of {self.dims_in} dims, got {vectors.shape[-1]}"
+            )
+        return vectors @ self.components
+
+    @staticmethod
+    def key(index_name: str) -> str:
+        return f"projection:{index_name}"
+
+    def save(self, client, index_name: str):
+        client.hset(
+            self.key(index_name),
+            mapping={
+                "dims_in": self.dims_in,
+                "dims_out": self.dims_out,
+                "fingerprint": self.fingerprint,
+                "components": base64.b64encode(self.components.tobytes()).decode(
+                    "ascii"
+                ),
+            },
+        )
+
+    @classmethod
+    def load(cls, client, index_name: str) -> Optional["Projection"]:
+        stored = client.hgetall(cls.key(index_name))
+        if not stored:
+            return None
+        stored = {
+            k.decode() if isinstance(k, bytes) else k: v for k, v in stored.items()
+        }
+        components = np.frombuffer(
+            base64.b64decode(stored["components"]), dtype=np.float32
+        )
+        return cls(components.reshape(int(stored["dims_in"]), int(stored["dims_out"])))
+
+    @classmethod
+    def stored_fingerprint(cls, client, index_name: str) -> Optional[str]:
+        # None for a projection saved without one
+        value = client.hget(cls.key(index_name), "fingerprint")
+        return value.decode() if isinstance(value, bytes) else value
+
+
+class ProjectedVectorizer(BaseVectorizer):
+    """Another vectorizer with its embeddings passed through a Projection.
+
+    With `source`, the (redis client, index name) the projection was loaded
+    from, the stored fingerprint is checked before an embedding at most every
+    `check_interval` seconds, and the projection reloaded when a load (e.g.
+    `load_redis.py --mode reset`) has fitted and stored a new one.
+    """
+
+    vectorizer: Any
+    projection: Any
+    source: Any = None
+    check_interval: float = 5.0
+    checked_at: float = 0.0
+
+    def __init__(
+        self,
+        vectorizer: BaseVectorizer,
+        projection: Projection,
+        source: Optional[Tuple[Any, str]] = None,
+        check_interval: float = 5.0,
+    ):
+        if vectorizer.dims != projection.dims_in:
+            raise ValueError(
+                f"The {vectorizer.model} vectorizer has {vectorizer.dims} dims but "
+                f"the projection expects {projection.dims_in}"
+            )
+        super().__init__(
+            model=f"{vectorizer.model}+pca{projection.dims_out}",
+            dims=projection.dims_out,
+            client=vectorizer.client,
+            vectorizer=vectorizer,
+            projection=projection,
+            source=source,
+            check_interval=check_interval,
+        )
+
+    def current(self) -> Projection:
+        if (
+            self.source is None
+            or time.monotonic() - self.checked_at < self.check_interval
+        ):
+            return self.projection
+        self.checked_at = time.monotonic()
+        client, index_name = self.source
+        stored = Projection.stored_fingerprint(client, index_name)
+        if stored and stored != self.projection.fingerprint:
+            projection = Projection.load(client, index_name)
+            if projection is not None:
+                if projection.components.shape != self.projection.components.shape:
+                    raise ValueError(
+                        f"The projection of index {index_name} is now "
+                        f"{projection.dims_in} to {projection.dims_out} dims, "
+                        f"restart the app with the matching index_profile"
+                    )
+                self.projection = projection
+        return self.projection
+
+    def embed_many(
+        self,
+        texts: List[str],
+        preprocess: Optional[Callable] = None,
+        batch_size: int = 10,
+        as_buffer: bool = False,
+        **kwargs,
+    ) -> List[List[float]]:
+        embeddings = self.vectorizer.embed_many(
+            texts, preprocess=preprocess, batch_size=batch_size
+        )
+        projected = self.current().transform(embeddings)
+        return [self._process_embedding(v.tolist(), as_buffer) for v in projected]
+
+    def embed(
+        self,
+        text: str,
+        preprocess: Optional[Callable] = None,
+        as_buffer: bool = False,
+        **kwargs,
+    ) -> List[float]:
+        return self.embed_many([text], preprocess=preprocess, as_buffer=as_buffer)[0]
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import time
+from typing import Callable, List, Optional
+
+from embedding_cache import normalize_text
+from tracing import count
+
+# Prompts looked up in the cache, replayed by utils/tune_cache_threshold.py
+PROMPT_LOG = "promptlog:llmcache"
+
+
+def prompt_digest(prompt: str) -> str:
+    return hashlib.sha256(normalize_text(prompt).casefold().encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """Exact-match tier in front of a SemanticCache.
+
+    The exact tier is a string under {prefix}:exact:{sha256 of the prompt
+    with whitespace collapsed and case folded} holding the response, checked
+    before the prompt is embedded. The semantic tier is the SemanticCache
+    range query on the prompt vector. Entries of both tiers expire after ttl
+    seconds without a hit, and a sorted set of last-access times caps them at
+    max_entries, the least recently used entries are evicted first, so the
+    SemanticCache must be created with a ttl. A hit whose response fails
+    valid(response), e.g. one linking to a poster the store has evicted, is
+    dropped from both tiers and answered as a miss. Lookups and evictions are
+    counted in the llmcache_* metrics.
+    """
+
+    def __init__(
+        self,
+        semantic,
+        redis_client,
+        max_entries: Optional[int] = None,
+        log_entries: Optional[int] = None,
+        valid: Optional[Callable[[str], bool]] = None,
+    ):
+        self.semantic = semantic
+        self.redis_client = redis_client
+        # the semantic tier refreshes the TTL of its entries on hits, the
+        # exact tier does the same with the same TTL
+        self.ttl = semantic.ttl
+        self.max_entries = max_entries or int(os.getenv("llmcache_max_entries", 10000))
+        self.log_entries = log_entries or int(os.getenv("llmcache_log_entries", 10000))
+        self.prefix = semantic.index.prefix
+        self.valid = valid
+
+    def _exact_key(self, prompt: str) -> str:
+        return f"{self.prefix}:exact:{prompt_digest(prompt)}"
+
+    def _touch(self, keys: List[str]):
+        self.redis_client.zadd(f"{self.prefix}:lru", {k: time.time() for k in keys})
+
+    def _stale(self, response: str, keys: List[str]) -> bool:
+        # drops the entries `keys` of a hit that can not be served any more
+        if self.valid is None or self.valid(response):
+            return False
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.zrem(f"{self.prefix}:lru", *keys)
+        pipe.execute()
+        return True
+
+    def check_exact(self, prompt: str) -> Optional[str]:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.getex(self._exact_key(prompt), ex=self.ttl)
+        pipe.xadd(
+            PROMPT_LOG, {"prompt": prompt}, maxlen=self.log_entries, approximate=True
+        )
+        response = pipe.execute()[0]
+        if response and self._stale(response, [self._exact_key(prompt)]):
+            count("llmcache_lookups", tier="exact", result="stale")
+            return None
+        count("llmcache_lookups", tier="exact", result="hit" if response else "miss")
+        if response:
+            self._touch([self._exact_key(prompt)])
+        return response
+
+    def check(self, prompt: str, vector: List[float]) -> Optional[str]:
+        hits = self.semantic.check(vector=vector, return_fields=["response"])
+        if hits and self._stale(hits[0]["response"], [hits[0]["id"]]):
+            count("llmcache_lookups", tier="semantic", result="stale")
+            return None
+        count("llmcache_lookups", tier="semantic", result="hit" if hits else "miss")
+        if not hits:
+            return None
+        key, response = hits[0]["id"], hits[0]["response"]
+        # the next lookup of this exact prompt skips the embedding and search
+        self.redis_client.set(self._exact_key(prompt), response, ex=self.ttl)
+        self._touch([key, self._exact_key(prompt)])
+        return response
+
+    def store(self, prompt: str, response: str, vector: List[float]) -> str:
+        key = self.semantic.store(prompt=prompt, response=response, vector=vector)
+        self._store(prompt, response, [key])
+        return key
+
+    def store_exact(self, prompt: str, response: str):
+        """Store `response` in the exact tier only, for prompts answered
+        without an embedding."""
+        self._store(prompt, response, [])
+
+    def _store(self, prompt: str, response: str, keys: List[str]):
+        # the exact entry of `prompt`, and `keys` of the semantic tier in the LRU
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(self._exact_key(prompt), response, ex=self.ttl)
+        pipe.zadd(
+            f"{self.prefix}:lru", {k: now for k in keys + [self._exact_key(prompt)]}
+        )
+        # entries not hit within the ttl have expired already
+        pipe.zremrangebyscore(f"{self.prefix}:lru", "-inf", now - self.ttl)
+        pipe.zcard(f"{self.prefix}:lru")
+        size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            evicted = self.redis_client.zpopmin(
+                f"{self.prefix}:lru", size - self.max_entries
+            )
+            if evicted:
+                self.redis_client.delete(*[k for k, _ in evicted])
+                count("llmcache_evictions", len(evicted))
+
+    def clear(self):
+        # every key of both tiers and the LRU set are under the prefix
+        self.semantic.clear()
@@ -0,0 +1,214 @@
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+
+import redis
+from dotenv import load_dotenv
+from openai import OpenAI
+from redisvl.extensions.llmcache import SemanticCache
+from redisvl.index import SearchIndex
+from redisvl.utils.vectorize import BaseVectorizer
+
+from embedding_cache import CachedVectorizer
+from index_profiles import build_index, index_projection, index_target
+from poster_store import PosterStore
+from projection import Projection, ProjectedVectorizer
+from prompt_cache import TieredCache
+from result_cache import ResultCache
+from single_flight import SingleFlight
+from shards import ShardedIndex, shard_endpoints
+from tracing import observe, serve_metrics, span
+from vector_engine import VectorEngine
+from vectorizers import make_vectorizer
+
+# Everything below is built once per process and shared by all sessions and
+# reruns, instead of once per request in every page. functools.cache rather
+# than st.cache_resource so the same objects also work outside `streamlit run`.
+_start = time.perf_counter()
+load_dotenv(dotenv_path="app.config")
+observe("startup", "config", time.perf_counter() - _start)
+
+
+@functools.cache
+def get_redis_pool(decode_responses=True, host=None, port=None) -> redis.ConnectionPool:
+    # redis_host unless the host and port of a shard are given
+    kwargs = {
+        "host": host or os.getenv("redis_host"),
+        "port": port or os.getenv("redis_port"),
+        "decode_responses": decode_responses,
+        "max_connections": int(os.getenv("redis_max_connections", 32)),
+        "timeout": int(os.getenv("redis_pool_timeout", 20)),
+    }
+    if os.getenv("redis_user"):
+        kwargs["username"] = os.getenv("redis_user")
+        kwargs["password"] = os.getenv("redis_pass")
+    # Blocks for up to `timeout` seconds when every connection is in use
+    # instead of opening more
+    return redis.BlockingConnectionPool(**kwargs)
+
+
+@functools.cache
+def get_redis_conn(decode_responses=True) -> redis.Redis:
+    return redis.Redis(connection_pool=get_redis_pool(decode_responses))
+
+
+@functools.cache
+def get_shard_conn(host, port) -> redis.Redis:
+    return redis.Redis(connection_pool=get_redis_pool(True, host, port))
+
+
+@functools.cache
+def get_index() -> Union[SearchIndex, ShardedIndex]:
+    with span("connect"):
+        if endpoints := shard_endpoints():
+            shards = []
+            for host, port in endpoints:
+                shard = build_index()
+                shard.set_client(client=get_shard_conn(host, port))
+                shards.append(shard)
+            return ShardedIndex(shards)
+        jindex = build_index()
+        jindex.set_client(client=get_redis_conn())
+    return jindex
+
+
+@functools.cache
+def get_vectorizer() -> BaseVectorizer:
+    jindex = get_index()
+    with span("connect"):
+        vectorizer = CachedVectorizer(make_vectorizer(), redis_client=get_redis_conn())
+        if index_projection():
+            # query vectors go through the projection the documents were
+            # loaded with
+            projection = Projection.load(get_redis_conn(), jindex.name)
+            if projection is None:
+                raise ValueError(
+                    f"No projection stored for index {jindex.name}, load the data "
+                    f"with utils/load_redis.py using this index_profile"
+                )
+            # reloaded when a later load refits it
+            vectorizer = ProjectedVectorizer(
+                vectorizer, projection, source=(get_redis_conn(), jindex.name)
+            )
+
+    dims = jindex.schema.fields["embedding"].attrs.dims
+    if vectorizer.dims != dims:
+        raise ValueError(
+            f"The {vectorizer.model} vectorizer has {vectorizer.dims} dims but the "
+            f"index expects {dims}, set index_profile to match vectorizer_backend"
+        )
+    return vectorizer
+
+
+@functools.cache
+def get_replica() -> Optional[VectorEngine]:
+    # in-process copy of the index over the sidecar in search_replica, used
+    # for the read-only KNN searches of the pages when set
+    path = os.getenv("search_replica")
+    if not path:
+        return None
+    jindex = get_index()
+    with span("connect"):
+        _, prefix = index_target(jindex.client, jindex.name) or (None, None)
+        replica = VectorEngine(path, prefix=prefix)
+    dims = jindex.schema.fields["embedding"].attrs.dims
+    if replica.dims != dims:
+        raise ValueError(
+            f"The search replica in {path} has {replica.dims} dims but the index "
+            f"expects {dims}"
+        )
+    return replica
+
+
+@functools.cache
+def get_result_cache() -> ResultCache:
+    return ResultCache(get_redis_conn())
+
+
+@functools.cache
+def get_openai_client() -> OpenAI:
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+@functools.cache
+def get_llmcache() -> TieredCache:
+    # The cache embeds with the same vectorizer as the movie index, so one
+    # prompt vector serves the cache check, the KNN search and the store.
+    # Vectors are stored as raw bytes, so this one uses the non-decoding pool.
+    vectorizer = get_vectorizer()
+    r = get_redis_conn(False)
+    with span("connect"):
+        llmcache = SemanticCache(
+            name="llmcache",
+            prefix="llmcache",
+            # tune with utils/tune_cache_threshold.py
+            distance_threshold=float(os.getenv("llmcache_distance_threshold", 0.2)),
+            ttl=int(os.getenv("llmcache_ttl", 7 * 24 * 3600)),
+            vectorizer=vectorizer,
+            redis_client=r,
+        )
+
+    # An index built for another embedding model can not be searched with
+    # this model's vectors, rebuild it (dropping its entries) when it changes
+    model = f"{vectorizer.model}:{vectorizer.dims}".encode()
+    if r.get("llmcache:model") != model:
+        llmcache.delete()
+        llmcache.index.create()
+        r.set("llmcache:model", model)
+    # answers linking to an evicted poster are dropped on their next hit
+    return TieredCache(llmcache, get_redis_conn(), valid=get_poster_store().available)
+
+
+@functools.cache
+def get_executor() -> ThreadPoolExecutor:
+    # for the steps of a request that can overlap, e.g. poster generation
+    # and embedding in Movie Maker
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("pipeline_workers", 8)),
+        thread_name_prefix="pipeline",
+    )
+
+
+@functools.cache
+def get_single_flight() -> SingleFlight:
+    return SingleFlight(get_redis_conn())
+
+
+@functools.cache
+def get_poster_store() -> PosterStore:
+    return PosterStore(get_redis_conn())
+
+
+@functools.cache
+def get_metrics_server():
+    # one /metrics endpoint per process, disabled when metrics_port is unset.
+    # Only the first process on a host gets the port, the others go without.
+    port = os.getenv("metrics_port")
+    if not port:
+        return None
+    host = os.getenv("metrics_host", "127.0.0.1")
+    try:
+        return serve_metrics(int(port), host=host)
+    except OSError as e:
+        print(f"Metrics not served on {host}:{port}: {e}")
+        return None
+
+
+def pool_stats() -> dict:
+    pools = {
+        "decoded": get_redis_pool(True),
+        "raw": get_redis_pool(False),
+        **{f"shard {h}:{p}": get_redis_pool(True, h, p) for h, p in shard_endpoints()},
+    }
+    stats = {}
+    for name, pool in pools.items():
+        idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        stats[name] = {
+            "max_connections": pool.max_connections,
+            "created": len(pool._connections),
+            "in_use": len(pool._connections) - idle,
+            "idle": idle,
+        }
+    return stats
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+# Bumped on every write to the movie documents. Cached results carry the
+# version they were computed at and are only served while it is current.
+VERSION_KEY = "movies:version"
+
+
+def bump_version(client) -> int:
+    return client.incr(VERSION_KEY)
+
+
+class ResultCache:
+    """Redis cache of KNN results, keyed by query.
+
+    An entry is a JSON string under results:{sha256 of the query vector,
+    filter, k and return fields} with a TTL, holding the results and the
+    index version they were computed at. The version counter and the entries
+    are read with a single MGET. A sorted set of last-access times caps the
+    cache at max_entries, the least recently used entries are evicted first.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        ttl: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        prefix: str = "results",
+    ):
+        self.redis_client = redis_client
+        self.ttl = ttl or int(os.getenv("result_cache_ttl", 600))
+        self.max_entries = max_entries or int(
+            os.getenv("result_cache_max_entries", 10000)
+        )
+        self.prefix = prefix
+
+    def digest(self, query) -> str:
+        vector = query._vector
+        if not isinstance(vector, bytes):
+            vector = np.asarray(vector, dtype=np.float32).tobytes()
+        h = hashlib.sha256(vector)
+        h.update(
+            json.dumps(
+                [str(query._filter), query._num_results, sorted(query._return_fields)]
+            ).encode("utf-8")
+        )
+        return h.hexdigest()
+
+    def get_many(self, queries):
+        """Return the current index version and the cached results of each
+        query, None where there is no current entry."""
+        digests = [self.digest(q) for q in queries]
+        values = self.redis_client.mget(
+            [VERSION_KEY] + [f"{self.prefix}:{d}" for d in digests]
+        )
+
+        version = int(values[0] or 0)
+        results, hits = [], []
+        for d, value in zip(digests, values[1:]):
+            entry = json.loads(value) if value else None
+            current = entry is not None and entry["version"] == version
+            results.append(entry["results"] if current else None)
+            if current:
+                hits.append(d)
+        # only hits, a miss in the LRU set would hold a slot with no entry;
+        # set_many adds the misses once they are stored
+        if hits:
+            self.redis_client.zadd(f"{self.prefix}:lru", {d: time.time() for d in hits})
+        return version, results
+
+    def set_many(self, version: int, queries, results: List[list]):
+        digests = [self.digest(q) for q in queries]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for d, docs in zip(digests, results):
+            entry = json.dumps({"version": version, "results": docs})
+            pipe.set(f"{self.prefix}:{d}", entry, ex=self.ttl)
+        pipe.zadd(f"{self.prefix}:lru", {d: time.time() for d in digests})
+        pipe.zcard(f"{self.prefix}:lru")
+        size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            evicted = self.redis_client.zpopmin(
+                f"{self.prefix}:lru", size - self.max_entries
+            )
+            if evicted:
+                self.redis_client.delete(*[f"{self.prefix}:{d}" for d, _ in evicted])
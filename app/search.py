@@ -0,0 +1,99 @@
+import json
+
+from redis.commands.search.result import Result
+from redisvl.index.index import process_results
+
+from shards import ShardedIndex
+from tracing import add_payload
+
+
+def payload_size(results) -> int:
+    # bytes of the returned field values, roughly what came over the wire
+    return sum(len(str(v)) for docs in results for doc in docs for v in doc.values())
+
+
+def merge(query, results) -> list:
+    """The top k by distance of the top k of a KNN `query` on every shard."""
+    docs = [doc for docs in results for doc in docs]
+    docs.sort(key=lambda doc: float(doc["vector_distance"]))
+    return docs[: query._num_results]
+
+
+def query_many(jindex, queries):
+    """Run several redisvl queries against `jindex` in one pipelined round
+    trip and return the processed results of each, in order. A sharded
+    index gets one round trip per shard, all at once."""
+    if isinstance(jindex, ShardedIndex):
+        per_shard = jindex.map(lambda shard: query_many(shard, queries))
+        return [merge(q, results) for q, results in zip(queries, zip(*per_shard))]
+
+    pipe = jindex.client.ft(jindex.name).pipeline(transaction=False)
+    for q in queries:
+        pipe.search(q.query, query_params=q.params)
+
+    results = []
+    for q, raw in zip(queries, pipe.execute()):
+        result = Result(
+            raw,
+            not q.query._no_content,
+            duration=0,
+            has_payload=q.query._with_payloads,
+            with_scores=q.query._with_scores,
+        )
+        results.append(
+            process_results(result, query=q, storage_type=jindex.storage_type)
+        )
+    return results
+
+
+def knn(jindex, queries, replica=None, cache=None):
+    """Run `queries` on the in-process `replica` when there is one, and in one
+    pipelined round trip to `jindex` otherwise. With a result `cache`, only
+    the queries without a current cached result are sent to Redis."""
+    if replica is not None:
+        return [replica.query(q) for q in queries]
+    if cache is None:
+        results = query_many(jindex, queries)
+        add_payload("knn_search", payload_size(results))
+        return results
+
+    version, results = cache.get_many(queries)
+    misses = [q for q, cached in zip(queries, results) if cached is None]
+    if misses:
+        fresh = query_many(jindex, misses)
+        cache.set_many(version, misses, fresh)
+        fresh = iter(fresh)
+        results = [next(fresh) if cached is None else cached for cached in results]
+    add_payload("knn_search", payload_size(results))
+    return results
+
+
+def json_mget(client, keys, fields):
+    """Return {field: [value in each of `keys`]} of the JSON documents `keys`,
+    one JSON.MGET per field in a single round trip. With a ShardedIndex as
+    `client`, one round trip per shard holding any of the keys."""
+    if isinstance(client, ShardedIndex):
+        groups = client.group(keys)
+        parts = client.map(
+            lambda shard, positions: (
+                json_mget(shard.client, [keys[i] for i in positions], fields)
+                if positions
+                else {}
+            ),
+            groups,
+        )
+        values = {field: [None] * len(keys) for field in fields}
+        for positions, part in zip(groups, parts):
+            for field in part:
+                for i, value in zip(positions, part[field]):
+                    values[field][i] = value
+        return values
+
+    pipe = client.pipeline(transaction=False)
+    for field in fields:
+        pipe.json().mget(keys, f"$.{field}")
+    values = {}
+    for field, per_key in zip(fields, pipe.execute()):
+        values[field] = [value[0] if value else None for value in per_key]
+    add_payload("details", len(json.dumps(values)))
+    return values
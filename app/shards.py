@@ -0,0 +1,126 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from redisvl.index import SearchIndex
+
+from tracing import submit
+
+# Sharded mode: with redis_shards set in app.config, the movie documents are
+# split across those Redis endpoints by a hash of their id, and every shard
+# has the index of movie_index.yaml over its own documents. KNN searches fan
+# out to all shards in parallel and the top k of each are merged by distance
+# (search.py). Everything else, the caches, result versions, projection and
+# posters, stays on redis_host.
+
+
+def shard_endpoints() -> List[Tuple[str, int]]:
+    """The (host, port) of every shard in redis_shards, e.g.
+    "127.0.0.1:6380,127.0.0.1:6381", empty when not sharded."""
+    endpoints = []
+    for endpoint in os.getenv("redis_shards", "").split(","):
+        if endpoint.strip():
+            host, _, port = endpoint.strip().rpartition(":")
+            endpoints.append((host or "127.0.0.1", int(port)))
+    return endpoints
+
+
+def shard_of(doc_id, n) -> int:
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(str(doc_id).encode("utf-8")) % n
+
+
+def key_id(key: str) -> str:
+    # the document id of a key, prefix:id
+    return key.rsplit(":", 1)[-1]
+
+
+class ShardedIndex:
+    """The same index on every shard, usable where a SearchIndex is for
+    searches (search.query_many), document reads (search.json_mget) and
+    writes (RoutedPipeline, load)."""
+
+    def __init__(self, shards: List[SearchIndex]):
+        self.shards = shards
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(shards), thread_name_prefix="shard"
+        )
+
+    @property
+    def name(self) -> str:
+        return self.shards[0].name
+
+    @property
+    def prefix(self) -> str:
+        return self.shards[0].prefix
+
+    @property
+    def schema(self):
+        return self.shards[0].schema
+
+    @property
+    def storage_type(self):
+        return self.shards[0].storage_type
+
+    @property
+    def client(self):
+        # the planner statistics come from the first shard, which holds a
+        # uniform sample of the movies by the id hash
+        return self.shards[0].client
+
+    def shard(self, doc_id) -> SearchIndex:
+        return self.shards[shard_of(doc_id, len(self.shards))]
+
+    def key(self, doc_id) -> str:
+        return self.shard(doc_id).key(doc_id)
+
+    def map(self, fn, *per_shard) -> list:
+        """Return fn(shard, *args) of every shard, run on all of them at once.
+        `per_shard` are lists with one argument per shard."""
+        futures = [
+            submit(self._executor, fn, shard, *args)
+            for shard, *args in zip(self.shards, *per_shard)
+        ]
+        return [f.result() for f in futures]
+
+    def group(self, keys) -> List[List[int]]:
+        """The positions in `keys` of the keys of every shard."""
+        groups = [[] for _ in self.shards]
+        for pos, key in enumerate(keys):
+            groups[shard_of(key_id(key), len(self.shards))].append(pos)
+        return groups
+
+    def create(self, overwrite=False, drop=False):
+        self.map(lambda shard: shard.create(overwrite=overwrite, drop=drop))
+
+    def load(self, data, id_field) -> List[str]:
+        groups = [[] for _ in self.shards]
+        for doc in data:
+            groups[shard_of(doc[id_field], len(self.shards))].append(doc)
+        keys = self.map(lambda shard, docs: shard.load(docs, id_field=id_field), groups)
+        return [key for shard_keys in keys for key in shard_keys]
+
+    def info(self) -> list:
+        return self.map(lambda shard: shard.info())
+
+
+class RoutedPipeline:
+    """A pipeline per shard of `index`, commands on a document go to the one
+    route(doc_id) returns. A plain SearchIndex is a single shard."""
+
+    def __init__(self, index, transaction=False):
+        self.index = index
+        self.shards = index.shards if isinstance(index, ShardedIndex) else [index]
+        self.pipes = [s.client.pipeline(transaction=transaction) for s in self.shards]
+
+    def route(self, doc_id):
+        return self.pipes[shard_of(doc_id, len(self.pipes))]
+
+    def __len__(self) -> int:
+        return sum(len(pipe) for pipe in self.pipes)
+
+    def execute(self) -> list:
+        if len(self.pipes) == 1:
+            return [self.pipes[0].execute()]
+        return self.index.map(lambda _, pipe: pipe.execute(), self.pipes)
@@ -0,0 +1,147 @@
+import ast
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Sidecar layout, written from the csv by `python utils/sidecar.py` or by
+# `python utils/reembed.py`, and read by the loader and app/vector_engine.py
+#   metadata.parquet  every column except the embedding, genres as list<string>,
+#                     numbers as NUMERIC_COLUMNS and the rest as string
+#   embeddings.f32    raw float32 matrix (rows x dims), opened with np.memmap
+#   ids.npy           movie id of every row, in row order
+#   manifest.json     rows, dims and dtype of embeddings.f32
+METADATA_FILE = "metadata.parquet"
+EMBEDDINGS_FILE = "embeddings.f32"
+IDS_FILE = "ids.npy"
+MANIFEST_FILE = "manifest.json"
+
+# The type of every numeric column of the movies csv. pandas infers the dtype
+# of each chunk on its own, a blank cell turns an int column into float64, so
+# every reader sets these instead. Blank numbers stay missing (None in the
+# JSON documents, null in parquet), the other columns are text with blanks as "".
+NUMERIC_COLUMNS = {
+    "id": int,
+    "budget": int,
+    "vote_count": int,
+    "popularity": float,
+    "runtime": float,
+    "revenue": float,
+    "vote_average": float,
+}
+
+
+def parse_embeddings(values: pd.Series, dims: int, dtype=np.float32) -> np.ndarray:
+    # "[0.1, 0.2, ...]" strings -> one (n, dims) matrix in a single numpy call
+    # instead of one ast.literal_eval per row
+    flat = np.fromstring(",".join(values.str.slice(1, -1)), dtype=dtype, sep=",")
+    if flat.size != len(values) * dims:
+        raise ValueError(
+            f"Expected {len(values)} embeddings of {dims} dims, parsed {flat.size} values"
+        )
+    return flat.reshape(len(values), dims)
+
+
+def prepare_metadata(chunk: pd.DataFrame) -> pd.DataFrame:
+    """The metadata columns of a csv chunk with the same types whatever
+    pandas inferred for it, and genres parsed into a list."""
+    for column in chunk.columns:
+        if column in NUMERIC_COLUMNS:
+            values = pd.to_numeric(chunk[column], errors="coerce")
+            chunk[column] = values.astype(
+                "Int64" if NUMERIC_COLUMNS[column] is int else "float64"
+            )
+        elif column != "genres":
+            chunk[column] = chunk[column].fillna("").astype(str)
+    chunk["genres"] = chunk["genres"].apply(ast.literal_eval)
+    return chunk
+
+
+def metadata_schema(columns) -> pa.Schema:
+    types = {int: pa.int64(), float: pa.float64()}
+    return pa.schema(
+        [
+            (
+                column,
+                (
+                    pa.list_(pa.string())
+                    if column == "genres"
+                    else types.get(NUMERIC_COLUMNS.get(column), pa.string())
+                ),
+            )
+            for column in columns
+        ]
+    )
+
+
+def write_sidecar(outdir, chunks, dims):
+    # chunks yields (metadata DataFrame, (n, dims) float32 embeddings) pairs,
+    # the metadata as prepare_metadata returns it
+    os.makedirs(outdir, exist_ok=True)
+    rows, ids, writer = 0, [], None
+
+    with open(os.path.join(outdir, EMBEDDINGS_FILE), "wb") as emb_file:
+        for chunk, embeddings in chunks:
+            if embeddings.shape != (len(chunk), dims):
+                raise ValueError(
+                    f"Expected {len(chunk)} embeddings of {dims} dims, "
+                    f"got {embeddings.shape}"
+                )
+            if writer is None:
+                # explicit, so every chunk is written with the same types
+                schema = metadata_schema(chunk.columns)
+                writer = pq.ParquetWriter(os.path.join(outdir, METADATA_FILE), schema)
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            writer.write_table(table)
+            emb_file.write(embeddings.astype(np.float32).tobytes())
+            ids.append(chunk["id"].to_numpy(dtype=np.int64))
+            rows += len(chunk)
+
+    if writer is not None:
+        writer.close()
+    np.save(os.path.join(outdir, IDS_FILE), np.concatenate(ids))
+    with open(os.path.join(outdir, MANIFEST_FILE), "w") as f:
+        json.dump({"rows": rows, "dims": dims, "dtype": "float32"}, f)
+    return rows
+
+
+class Sidecar:
+    """Read-only view over a sidecar directory.
+
+    Embeddings are memory mapped, so slicing them does not copy or parse
+    anything until the rows are actually touched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        self.rows, self.dims = manifest["rows"], manifest["dims"]
+        self.embeddings = np.memmap(
+            os.path.join(path, EMBEDDINGS_FILE),
+            dtype=manifest["dtype"],
+            mode="r",
+            shape=(self.rows, self.dims),
+        )
+        self.ids = np.load(os.path.join(path, IDS_FILE), mmap_mode="r")
+        self._rows_by_id = None
+
+    def row(self, id) -> int:
+        if self._rows_by_id is None:
+            self._rows_by_id = {int(i): n for n, i in enumerate(self.ids)}
+        return self._rows_by_id[int(id)]
+
+    def embedding(self, id) -> np.ndarray:
+        return self.embeddings[self.row(id)]
+
+    def iter_chunks(self, chunk_size=1000):
+        # yields (records, embeddings) with embeddings as a zero-copy slice
+        start = 0
+        parquet = pq.ParquetFile(os.path.join(self.path, METADATA_FILE))
+        for batch in parquet.iter_batches(batch_size=chunk_size):
+            records = batch.to_pylist()
+            yield records, self.embeddings[start : start + len(records)]
+            start += len(records)
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional, Tuple
+
+from tracing import count, span
+
+# Deletes the lock only while it is still ours, it may have expired and been
+# taken by another process in the meantime
+_RELEASE = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs one computation per key at a time, for every thread of this
+    process and every process sharing the Redis server.
+
+    Within the process, the first caller of a key runs it and the others
+    wait for its result. Across processes, that caller takes the lock
+    {prefix}:lock:{key} (SET NX with lock_ttl) before running it, and
+    publishes the JSON result on {prefix}:done:{key}, also kept under
+    {prefix}:result:{key} for a few seconds for processes that subscribe
+    late. A process that finds the lock taken waits for the result for up to
+    wait_timeout seconds, and runs the computation itself when it times out
+    or the lock is released without one, e.g. after an error. Results must
+    be JSON serializable.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        prefix: str = "flight",
+        lock_ttl: Optional[float] = None,
+        wait_timeout: Optional[float] = None,
+        result_ttl: float = 10,
+    ):
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl or float(os.getenv("single_flight_lock_ttl", 120))
+        self.wait_timeout = wait_timeout or float(
+            os.getenv("single_flight_wait", self.lock_ttl)
+        )
+        self.result_ttl = result_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._release = redis_client.register_script(_RELEASE)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return the result of fn() for `key` and whether it was computed
+        by another caller."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            with span("flight_wait"):
+                finished = call.done.wait(self.wait_timeout)
+            if finished:
+                count("single_flight", role="follower", scope="process")
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            count("single_flight", role="fallback", scope="process")
+            return fn(), False
+
+        try:
+            call.result, shared = self._across_processes(key, fn)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _across_processes(self, key, fn) -> Tuple[Any, bool]:
+        lock = f"{self.prefix}:lock:{key}"
+        token = uuid.uuid4().hex
+        if self.redis_client.set(lock, token, nx=True, px=int(self.lock_ttl * 1000)):
+            count("single_flight", role="leader", scope="redis")
+            try:
+                result = fn()
+                data = json.dumps(result)
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.set(
+                    f"{self.prefix}:result:{key}", data, px=int(self.result_ttl * 1000)
+                )
+                pipe.publish(f"{self.prefix}:done:{key}", data)
+                pipe.execute()
+                return result, False
+            finally:
+                self._release(keys=[lock], args=[token])
+
+        with span("flight_wait"):
+            data = self._wait(key, lock)
+        if data is not None:
+            count("single_flight", role="follower", scope="redis")
+            return json.loads(data), True
+        count("single_flight", role="fallback", scope="redis")
+        return fn(), False
+
+    def _wait(self, key, lock) -> Optional[str]:
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f"{self.prefix}:done:{key}")
+        try:
+            deadline = time.monotonic() + self.wait_timeout
+            while True:
+                # published before the subscription, or the lock is gone
+                # without a result
+                if data := self.redis_client.get(f"{self.prefix}:result:{key}"):
+                    return data
+                if not self.redis_client.exists(lock):
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                message = pubsub.get_message(timeout=min(remaining, 1.0))
+                if message is not None:
+                    return message["data"]
+        finally:
+            pubsub.close()
@@ -0,0 +1,77 @@
+import json
+import re
+from typing import Any, Dict
+
+# "key": "string value still being streamed
+_OPEN_STRING = re.compile(r'^\s*"((?:[^"\\]|\\.)*)"\s*:\s*"((?:[^"\\]|\\.)*)\\?$', re.S)
+
+
+class StreamingJSON:
+    """Incremental parser for the top-level fields of a streamed JSON object.
+
+    Text is fed as it arrives. A field is available in `fields` as soon as
+    its value is complete, before the rest of the object has arrived.
+    partial() adds the string value that is still being streamed, for
+    display. Anything before the opening brace, such as a code fence, is
+    skipped.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = None
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        """Add `chunk` and return the fields it completed."""
+        self.text += chunk
+        completed = {}
+        for i in range(self._pos, len(self.text)):
+            c = self.text[i]
+            if self.done:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                continue
+            if self._depth == 1 and self._start is None and c not in " \t\r\n,":
+                self._start = i
+            if c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]" or (c == "," and self._depth == 1):
+                if c != ",":
+                    self._depth -= 1
+                if self._depth == 0 or (c == "," and self._depth == 1):
+                    completed.update(self._member(i))
+                    self.done = self._depth == 0
+        self._pos = len(self.text)
+        self.fields.update(completed)
+        return completed
+
+    def _member(self, end) -> Dict[str, Any]:
+        start, self._start = self._start, None
+        if start is None or start >= end:
+            return {}
+        return json.loads("{" + self.text[start:end] + "}")
+
+    def partial(self) -> Dict[str, Any]:
+        fields = dict(self.fields)
+        if self._start is not None and self._in_string:
+            if match := _OPEN_STRING.match(self.text[self._start :]):
+                key, value = match.groups()
+                try:
+                    fields[json.loads(f'"{key}"')] = json.loads(f'"{value}"')
+                except json.JSONDecodeError:
+                    # cut in the middle of an escape sequence
+                    pass
+        return fields
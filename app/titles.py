@@ -0,0 +1,101 @@
+import re
+from typing import Iterable, List, Tuple
+
+from redis.commands.search.suggestion import Suggestion
+
+# Fast path for prompts that are just a movie title. The loader puts every
+# normalized original_title in a suggestion dictionary (FT.SUGADD) under
+# titles:{index name}, with the keys of the movies of that title as the
+# payload. A prompt that matches a whole title, exactly or, when it is long
+# enough, within one typo, puts those documents first. When the prompt is
+# clearly meant as a title they are the whole answer, without an embedding
+# or a KNN search.
+
+# shorter prompts only match exactly, one edit away is another title
+MIN_FUZZY_LENGTH = 8
+# shorter titles ("Up", "Heat", "Love") are also words a search is meant
+# for, unless the prompt quotes them
+MIN_TITLE_ONLY_LENGTH = 8
+
+
+def dictionary_key(index_name) -> str:
+    return f"titles:{index_name}"
+
+
+def normalize_title(text: str) -> str:
+    # "Toy Story!" and "  toy story" are the same title
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def title_only(prompt: str) -> bool:
+    """Whether a title matching `prompt` is the whole answer: the prompt is
+    quoted, e.g. "Up", or long enough not to be a search."""
+    prompt = prompt.strip()
+    quoted = len(prompt) > 2 and prompt[0] + prompt[-1] in ('""', "''", "“”")
+    return quoted or len(normalize_title(prompt)) >= MIN_TITLE_ONLY_LENGTH
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    # one substitution, or one insertion in the longer string
+    return a[i + 1 :] == b[i + 1 :] if len(a) == len(b) else a[i:] == b[i + 1 :]
+
+
+def build_dictionary(client, key, titles: Iterable[Tuple[str, str]], batch_size=1000):
+    """Write the dictionary of the (document key, title) pairs `titles` to
+    `key`, replacing what was there."""
+    by_title = {}
+    for doc_key, title in titles:
+        if title := normalize_title(str(title)):
+            by_title.setdefault(title, []).append(doc_key)
+
+    client.delete(key)
+    items = [_suggestion(title, keys) for title, keys in by_title.items()]
+    for pos in range(0, len(items), batch_size):
+        # one pipelined round trip per batch
+        client.ft().sugadd(key, *items[pos : pos + batch_size])
+    return len(items)
+
+
+def add_title(client, key, title, doc_key):
+    """Add the movie `doc_key` to the dictionary, next to any other movies
+    with the same title."""
+    title = normalize_title(title)
+    if not title:
+        return
+    keys = [doc_key]
+    for s in client.ft().sugget(key, title, num=5, with_payloads=True):
+        if s.string == title and s.payload:
+            keys = s.payload.split() + keys
+    client.ft().sugadd(key, _suggestion(title, keys))
+
+
+def match_title(client, key, prompt) -> List[str]:
+    """The keys of the movies titled `prompt`, empty unless a title matches
+    the whole prompt."""
+    title = normalize_title(prompt)
+    if not title:
+        return []
+    fuzzy = len(title) >= MIN_FUZZY_LENGTH
+    suggestions = client.ft().sugget(
+        key, title, fuzzy=fuzzy, num=10, with_payloads=True
+    )
+    # suggestions are completions of the prompt, only a whole title counts
+    matches = [s for s in suggestions if s.string == title]
+    if not matches and fuzzy:
+        # a typo, as long as it can only be one title
+        matches = [s for s in suggestions if within_one_edit(s.string, title)]
+    if len(matches) != 1 or not matches[0].payload:
+        return []
+    return matches[0].payload.split()
+
+
+def _suggestion(title, keys) -> Suggestion:
+    return Suggestion(title, payload=" ".join(keys))
@@ -0,0 +1,218 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Per-stage timings of page requests. Every span is kept on the trace of the
+# request it ran in, for the breakdown shown under each answer, and counted
+# in a process-wide histogram per page and stage, which is served in the
+# Prometheus text format by serve_metrics(). The bytes of search results and
+# documents read from Redis are counted the same way, per page and stage.
+# Other events, such as cache hits and evictions, go to named counters.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = contextvars.ContextVar("trace", default=None)
+_histograms = {}
+_payload = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+
+def observe(page, stage, seconds):
+    with _lock:
+        _histograms.setdefault((page, stage), Histogram()).observe(seconds)
+
+
+class Trace:
+    def __init__(self, page):
+        self.page = page
+        self.spans = []
+        self.payload = 0
+        self.total = 0.0
+        self.marks = {}
+        self.start = time.perf_counter()
+
+    def stages(self) -> dict:
+        # seconds per stage, in the order the stages first ran
+        stages = {}
+        for stage, seconds in self.spans:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        return stages
+
+    def summary(self) -> str:
+        stages = self.stages()
+        stages["other"] = max(self.total - sum(stages.values()), 0.0)
+        breakdown = " · ".join(f"{s} {t * 1000:.0f} ms" for s, t in stages.items())
+        if self.payload:
+            breakdown += f" · payload {self.payload / 1024:.1f} KB"
+        marks = "".join(f" · {m} {s:.3f} s" for m, s in self.marks.items())
+        return f"Response time: {self.total:.3f} s{marks}  \n{breakdown}"
+
+
+@contextmanager
+def trace(page):
+    """Time one request of `page`; spans run inside it are attached to it."""
+    t = Trace(page)
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        t.total = time.perf_counter() - t.start
+        _current.reset(token)
+        observe(page, "total", t.total)
+
+
+@contextmanager
+def span(stage):
+    t = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if t is not None:
+            t.spans.append((stage, seconds))
+        observe(t.page if t is not None else "none", stage, seconds)
+
+
+def current_page() -> str:
+    t = _current.get()
+    return t.page if t is not None else "none"
+
+
+def mean_seconds(page, stage) -> float:
+    """Mean seconds of `stage` of `page` so far, 0 when it has not run."""
+    with _lock:
+        h = _histograms.get((page, stage))
+        return h.sum / h.count if h is not None and h.count else 0.0
+
+
+def mark(name):
+    """Record the time since the start of the current request as `name`,
+    e.g. the time to the first content shown, once per request."""
+    t = _current.get()
+    if t is None or name in t.marks:
+        return
+    t.marks[name] = time.perf_counter() - t.start
+    observe(t.page, name, t.marks[name])
+
+
+def submit(executor, fn, *args, **kwargs):
+    """Run `fn` on `executor` in a copy of the current context, so the spans
+    it runs are attached to the current request."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def add_payload(stage, size):
+    """Count `size` bytes read from Redis by `stage` of the current request."""
+    t = _current.get()
+    if t is not None:
+        t.payload += size
+    key = (t.page if t is not None else "none", stage)
+    with _lock:
+        _payload[key] = _payload.get(key, 0) + size
+
+
+def count(name, n=1, **labels):
+    """Add `n` to the counter movies_{name}_total with `labels`."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def counters() -> dict:
+    with _lock:
+        return dict(_counters)
+
+
+def payload() -> dict:
+    with _lock:
+        return dict(_payload)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {key: {"count": h.count, "sum": h.sum} for key, h in _histograms.items()}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _payload.clear()
+        _counters.clear()
+
+
+def metrics_text() -> str:
+    lines = [
+        "# HELP movies_stage_seconds Time spent in each stage of a page request",
+        "# TYPE movies_stage_seconds histogram",
+    ]
+    with _lock:
+        for (page, stage), h in sorted(_histograms.items()):
+            labels = f'page="{page}",stage="{stage}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h.counts):
+                cumulative += count
+                lines.append(
+                    f'movies_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'movies_stage_seconds_bucket{{{labels},le="+Inf"}} {h.count}')
+            lines.append(f"movies_stage_seconds_sum{{{labels}}} {h.sum}")
+            lines.append(f"movies_stage_seconds_count{{{labels}}} {h.count}")
+        lines += [
+            "# HELP movies_payload_bytes_total Bytes of results read from Redis",
+            "# TYPE movies_payload_bytes_total counter",
+        ]
+        for (page, stage), size in sorted(_payload.items()):
+            lines.append(
+                f'movies_payload_bytes_total{{page="{page}",stage="{stage}"}} {size}'
+            )
+        for name in sorted({name for name, _ in _counters}):
+            lines.append(f"# TYPE movies_{name}_total counter")
+            for (counter, labels), n in sorted(_counters.items()):
+                if counter == name:
+                    labels = ",".join(f'{k}="{v}"' for k, v in labels)
+                    labels = f"{{{labels}}}" if labels else ""
+                    lines.append(f"movies_{name}_total{labels} {n}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        data = metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve_metrics(port, host="127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics on `port` from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
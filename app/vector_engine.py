@@ -0,0 +1,183 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from redisvl.query import VectorQuery
+from redisvl.query.filter import FilterExpression, FilterOperator
+
+from index_profiles import SCHEMA_FILE, load_schema
+from sidecar_format import EMBEDDINGS_FILE, METADATA_FILE, Sidecar
+
+NORMALIZED_FILE = "embeddings.norm.f32"
+
+# The leaf filters redisvl renders for Num and Tag fields, e.g.
+#   @runtime:[-inf (120]   (-@budget:[0 0])   @genres:{science\ fiction|war}
+_NUM_FILTER = re.compile(r"^(\(-)?@(\w+):\[(\()?(\S+) (\()?(\S+)\]\)?$")
+_TAG_FILTER = re.compile(r"^(\(-)?@(\w+):\{(.*)\}\)?$")
+
+
+class VectorEngine:
+    """In-process, read-only replica of the movie index over a sidecar.
+
+    The embeddings are L2-normalized once into embeddings.norm.f32 next to
+    the sidecar and memory mapped, so cosine similarity is a single
+    matrix-vector product. The numeric and tag fields of the index schema are
+    kept as column arrays and one boolean mask per tag, the filter of a
+    VectorQuery is evaluated on those before ranking. Results have the same
+    shape as SearchIndex.query().
+    """
+
+    def __init__(
+        self, path: str, schema_path: str = SCHEMA_FILE, prefix: Optional[str] = None
+    ):
+        schema = load_schema(schema_path, profile="flat")
+        # the key prefix of the ids returned, the live one when given
+        self.prefix = prefix or schema["index"]["prefix"]
+        self.sidecar = Sidecar(path)
+        self.dims = self.sidecar.dims
+        self.ids = np.asarray(self.sidecar.ids)
+        self.vectors = self._normalized(path)
+
+        metadata = pq.read_table(os.path.join(path, METADATA_FILE)).to_pandas()
+        self.metadata = metadata
+        self.numeric = {}
+        self.tags = {}
+        for field in schema["fields"]:
+            name = field["name"]
+            if name not in metadata:
+                continue
+            if field["type"] == "numeric":
+                self.numeric[name] = pd.to_numeric(
+                    metadata[name], errors="coerce"
+                ).to_numpy(dtype=np.float64)
+            elif field["type"] == "tag":
+                self.tags[name] = self._tag_masks(metadata[name])
+
+    def _normalized(self, path) -> np.memmap:
+        raw = self.sidecar.embeddings
+        normalized = os.path.join(path, NORMALIZED_FILE)
+        if not os.path.exists(normalized) or os.path.getmtime(
+            normalized
+        ) < os.path.getmtime(os.path.join(path, EMBEDDINGS_FILE)):
+            out = np.memmap(normalized, dtype=np.float32, mode="w+", shape=raw.shape)
+            for start in range(0, len(raw), 10000):
+                chunk = np.asarray(raw[start : start + 10000], dtype=np.float32)
+                norms = np.linalg.norm(chunk, axis=1, keepdims=True)
+                out[start : start + 10000] = chunk / np.maximum(norms, 1e-12)
+            out.flush()
+            del out
+        return np.memmap(normalized, dtype=np.float32, mode="r", shape=raw.shape)
+
+    def _tag_masks(self, column: pd.Series) -> Dict[str, np.ndarray]:
+        # Redis tags match case-insensitively
+        masks = {}
+        for row, value in enumerate(column):
+            values = value if isinstance(value, (list, np.ndarray)) else [value]
+            for tag in values:
+                if tag is None or tag == "":
+                    continue
+                tag = str(tag).lower()
+                if tag not in masks:
+                    masks[tag] = np.zeros(len(column), dtype=bool)
+                masks[tag][row] = True
+        return masks
+
+    def mask(self, expression: Optional[FilterExpression]) -> Optional[np.ndarray]:
+        """Rows matching `expression`, or None when it matches every row."""
+        if expression is None:
+            return None
+        if expression._operator:
+            left = self.mask(expression._left)
+            right = self.mask(expression._right)
+            # like redisvl, a wildcard side drops out of AND and OR alike
+            if left is None or right is None:
+                return right if left is None else left
+            if expression._operator == FilterOperator.OR:
+                return left | right
+            return left & right
+
+        leaf = str(expression)
+        if leaf == "*":
+            return None
+        if match := _NUM_FILTER.match(leaf):
+            negate, field, lo_open, lo, hi_open, hi = match.groups()
+            column = self._column(self.numeric, field)
+            lo, hi = float(lo), float(hi)
+            rows = (column > lo if lo_open else column >= lo) & (
+                column < hi if hi_open else column <= hi
+            )
+        elif match := _TAG_FILTER.match(leaf):
+            negate, field, values = match.groups()
+            masks = self._column(self.tags, field)
+            rows = np.zeros(len(self.ids), dtype=bool)
+            for tag in re.split(r"(?<!\\)\|", values):
+                tag = re.sub(r"\\(.)", r"\1", tag).strip().lower()
+                if tag in masks:
+                    rows |= masks[tag]
+        else:
+            raise ValueError(f"Filter {leaf!r} is not supported by the local engine")
+        return ~rows if negate else rows
+
+    def _column(self, columns, field):
+        if field not in columns:
+            raise ValueError(f"Field {field!r} is not filterable in the local engine")
+        return columns[field]
+
+    def search(self, vector, k: int, mask: Optional[np.ndarray] = None):
+        """Return the rows and cosine distances of the `k` nearest rows."""
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dims,):
+            raise ValueError(
+                f"Expected a vector of {self.dims} dims, got {vector.shape}"
+            )
+        vector = vector / max(np.linalg.norm(vector), 1e-12)
+
+        if mask is None:
+            candidates = None
+            scores = self.vectors @ vector
+        else:
+            candidates = np.flatnonzero(mask)
+            scores = self.vectors[candidates] @ vector
+
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        rows = top if candidates is None else candidates[top]
+        return rows, 1.0 - scores[top]
+
+    def _value(self, row: int, field: str) -> Any:
+        # values come back as strings, as they do from FT.SEARCH
+        if field == "embedding":
+            return json.dumps(self.sidecar.embeddings[row].tolist())
+        value = self.metadata[field].iat[row]
+        if isinstance(value, (list, np.ndarray)):
+            return json.dumps(list(value))
+        return str(value)
+
+    def query(self, query: VectorQuery) -> List[Dict[str, Any]]:
+        vector = query._vector
+        if isinstance(vector, bytes):
+            vector = np.frombuffer(vector, dtype=query._dtype)
+        rows, distances = self.search(
+            vector, query._num_results, self.mask(query._filter)
+        )
+
+        docs = []
+        for row, distance in zip(rows, distances):
+            doc = {
+                "id": f"{self.prefix}:{self.ids[row]}",
+                "vector_distance": str(float(distance)),
+            }
+            for field in query._return_fields:
+                # "$.genres" and the like are returned as the whole field
+                name = field[2:] if field.startswith("$.") else field
+                if name in self.metadata or name == "embedding":
+                    doc[field] = self._value(row, name)
+            docs.append(doc)
+        return docs
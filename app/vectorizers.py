@@ -0,0 +1,72 @@
+import os
+from typing import Callable, List, Optional
+
+from redisvl.utils.vectorize import BaseVectorizer, OpenAITextVectorizer
+
+OPENAI_MODEL = "text-embedding-ada-002"
+LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class LocalTextVectorizer(BaseVectorizer):
+    """sentence-transformers model running on the CPU of this process.
+
+    Texts are encoded in batches of `batch_size`, a query costs a few ms of
+    CPU instead of a network round trip.
+    """
+
+    batch_size: int
+
+    def __init__(self, model: str = LOCAL_MODEL, batch_size: int = 64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "The local vectorizer requires the sentence-transformers library. "
+                "Please install with `pip install sentence-transformers`"
+            )
+        client = SentenceTransformer(model, device="cpu")
+        super().__init__(
+            model=model,
+            dims=client.get_sentence_embedding_dimension(),
+            client=client,
+            batch_size=batch_size,
+        )
+
+    def embed_many(
+        self,
+        texts: List[str],
+        preprocess: Optional[Callable] = None,
+        batch_size: Optional[int] = None,
+        as_buffer: bool = False,
+        **kwargs,
+    ) -> List[List[float]]:
+        if preprocess:
+            texts = [preprocess(text) for text in texts]
+        embeddings = self.client.encode(
+            texts, batch_size=batch_size or self.batch_size, convert_to_numpy=True
+        )
+        return [self._process_embedding(e.tolist(), as_buffer) for e in embeddings]
+
+    def embed(
+        self,
+        text: str,
+        preprocess: Optional[Callable] = None,
+        as_buffer: bool = False,
+        **kwargs,
+    ) -> List[float]:
+        return self.embed_many([text], preprocess=preprocess, as_buffer=as_buffer)[0]
+
+
+def make_vectorizer(backend: Optional[str] = None) -> BaseVectorizer:
+    """Build the embedding backend selected by vectorizer_backend in app.config."""
+    backend = backend or os.getenv("vectorizer_backend") or "openai"
+    if backend == "openai":
+        return OpenAITextVectorizer(
+            model=OPENAI_MODEL,
+            api_config={"api_key": os.getenv("OPENAI_API_KEY")},
+        )
+    if backend == "local":
+        return LocalTextVectorizer(model=os.getenv("local_model") or LOCAL_MODEL)
+    raise ValueError(
+        f"Unknown vectorizer backend {backend!r}, expected openai or local"
+    )
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+from stub_openai import serve
+
+# Replays a JSONL workload through the same functions the pages call
+# (app/pipelines.py), from a pool of threads, and reports throughput and
+# latency percentiles per page. Each line of the workload is one request:
+#   {"path": "find_movies", "prompt": "..."}
+#   {"path": "semantic_caching", "prompt": "..."}
+#   {"path": "recommendations", "overview": "...", "genres": "drama",
+#    "filters": {"popularity_val": 10, "vote_avg_val": 6.5}}
+#   {"path": "movie_maker", "plotlines": ["...", "..."], "save": false}
+# By default the OpenAI APIs are served by the deterministic stub in
+# stub_openai.py, so runs on different commits can be compared.
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def load_workload(path, paths=None):
+    with open(path) as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    return [r for r in requests if not paths or r["path"] in paths]
+
+
+def handlers():
+    import pipelines
+
+    def movie_maker(request):
+        descriptions, embeddings = pipelines.match_plotlines(request["plotlines"])
+        # a no-op on_update, so the time to first content is recorded
+        payload, _, embedding = pipelines.make_movie(
+            pipelines.movie_prompt(descriptions),
+            on_update=lambda fields: None,
+            embed=request.get("save", False),
+        )
+        if request.get("save"):
+            pipelines.save_movie(payload, embedding)
+
+    return {
+        "find_movies": lambda r: pipelines.find_movies(r["prompt"]),
+        "semantic_caching": lambda r: pipelines.poster_response(r["prompt"]),
+        "recommendations": lambda r: pipelines.recommend(
+            r.get("overview", ""), genres=r.get("genres", "*"), **r.get("filters", {})
+        ),
+        "movie_maker": movie_maker,
+    }
+
+
+def clear_caches():
+    # start from empty embedding, result and semantic caches
+    import embedding_cache
+    from resources import get_llmcache, get_redis_conn
+
+    embedding_cache._local.clear()
+    r = get_redis_conn()
+    keys = list(r.scan_iter(match="embcache:*", count=1000))
+    keys += list(r.scan_iter(match="results:*", count=1000))
+    for i in range(0, len(keys), 1000):
+        r.delete(*keys[i : i + 1000])
+    get_llmcache().clear()
+
+
+def replay(requests, concurrency):
+    from tracing import trace
+
+    run = handlers()
+
+    def timed(request):
+        start = time.perf_counter()
+        try:
+            with trace(request["path"]):
+                run[request["path"]](request)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return request["path"], time.perf_counter() - start, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed, requests))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed, payload=None):
+    by_path = defaultdict(list)
+    for path, latency, error in samples:
+        by_path[path].append((latency, error))
+    by_path["all"] = [(latency, error) for _, latency, error in samples]
+
+    summary = {}
+    for path, rows in by_path.items():
+        latencies = np.array([latency for latency, error in rows if error is None])
+        errors = [error for _, error in rows if error is not None]
+        p50, p95, p99 = (
+            np.percentile(latencies * 1000, [50, 95, 99])
+            if len(latencies)
+            else (float("nan"),) * 3
+        )
+        summary[path] = {
+            "requests": len(rows),
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            # bytes of results read from Redis per request, see tracing.add_payload
+            "payload_kb": sum(
+                size
+                for (page, _), size in (payload or {}).items()
+                if page == path or path == "all"
+            )
+            / 1024
+            / len(rows),
+        }
+    return summary
+
+
+def stage_means(snapshot):
+    # mean ms per page and stage, from the tracing histograms
+    stages = defaultdict(dict)
+    for (page, stage), h in snapshot.items():
+        if page in ("startup", "none") or stage == "total":
+            continue
+        stages[page][stage] = h["sum"] / h["count"] * 1000
+    return dict(stages)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit or "unknown"
+
+
+def show(summary, baseline=None):
+    columns = [
+        "path",
+        "requests",
+        "errors",
+        "req/s",
+        "p50 ms",
+        "p95 ms",
+        "p99 ms",
+        "KB/req",
+    ]
+    table = Table(*columns)
+    metrics = ["throughput", "p50_ms", "p95_ms", "p99_ms", "payload_kb"]
+    for path, stats in summary.items():
+        cells = []
+        for metric in metrics:
+            cell = f"{stats[metric]:.2f}"
+            before = (baseline or {}).get(path, {}).get(metric)
+            if before:
+                cell += f" ({(stats[metric] - before) / before:+.0%})"
+            cells.append(cell)
+        table.add_row(path, str(stats["requests"]), str(stats["errors"]), *cells)
+    print(table)
+    for path, stats in summary.items():
+        if stats["first_error"] and path != "all":
+            print(f"[red]{path}: {stats['first_error']}[/red]")
+
+
+def show_stages(stages):
+    table = Table("path", "stage", "mean ms", title="Time per stage")
+    for path, by_stage in stages.items():
+        for stage, ms in by_stage.items():
+            table.add_row(path, stage, f"{ms:.2f}")
+    print(table)
+
+
+def title_fast_path(counters) -> dict:
+    # hit rate of the title fast path and time saved per hit, by page
+    paths = {}
+    for (name, labels), n in counters.items():
+        labels = dict(labels)
+        if name == "title_lookups":
+            stats = paths.setdefault(labels["page"], {"lookups": 0, "hits": 0})
+            stats["lookups"] += n
+            stats["hits"] += n if labels["result"] == "hit" else 0
+    for (name, labels), n in counters.items():
+        if name == "title_saved_seconds" and dict(labels)["page"] in paths:
+            stats = paths[dict(labels)["page"]]
+            stats["saved_ms_per_hit"] = n * 1000 / max(stats["hits"], 1)
+    return paths
+
+
+def show_fast_path(paths):
+    if not paths:
+        return
+    table = Table(
+        "path", "lookups", "hit rate", "saved ms/hit", title="Title fast path"
+    )
+    for path, stats in paths.items():
+        table.add_row(
+            path,
+            str(stats["lookups"]),
+            f"{stats['hits'] / stats['lookups']:.1%}",
+            f"{stats.get('saved_ms_per_hit', 0.0):.2f}",
+        )
+    print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a workload through the app code paths and time it"
+    )
+    parser.add_argument("--workload", default="utils/bench_workload.jsonl")
+    parser.add_argument(
+        "--paths", nargs="+", help="Only replay these paths, e.g. find_movies"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Untimed passes over the workload"
+    )
+    parser.add_argument(
+        "--cold",
+        action="store_true",
+        help="Clear the embedding, result and semantic caches",
+    )
+    parser.add_argument(
+        "--real-openai", action="store_true", help="Call the real OpenAI APIs"
+    )
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--image-latency", type=float, default=2.0)
+    parser.add_argument("--out", default="utils/bench_results")
+    parser.add_argument("--compare", help="A previous result file to diff against")
+    args = parser.parse_args()
+
+    if not args.real_openai:
+        serve(
+            port=args.stub_port,
+            latency={
+                "embeddings": args.embedding_latency,
+                "completions": args.chat_latency,
+                "generations": args.image_latency,
+            },
+            background=True,
+        )
+        # set before the app modules load app.config, which does not override
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.stub_port}"
+        os.environ["OPENAI_API_KEY"] = "stub"
+
+    sys.path.append(APP_DIR)
+    import tracing
+    from resources import get_index, get_llmcache, get_vectorizer
+
+    # build the shared resources up front so the first requests do not pay for it
+    get_index(), get_vectorizer(), get_llmcache()
+    if args.cold:
+        clear_caches()
+
+    workload = load_workload(args.workload, args.paths)
+    if not workload:
+        raise ValueError(f"No requests to replay in {args.workload}")
+    if args.warmup and not args.cold:
+        replay(workload * args.warmup, args.concurrency)
+
+    tracing.reset()
+    samples, elapsed = replay(workload * args.repeat, args.concurrency)
+    summary = summarize(samples, elapsed, tracing.payload())
+    stages = stage_means(tracing.snapshot())
+    fast_path = title_fast_path(tracing.counters())
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["summary"]
+    show(summary, baseline)
+    show_stages(stages)
+    show_fast_path(fast_path)
+
+    commit = git_commit()
+    os.makedirs(args.out, exist_ok=True)
+    outfile = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(outfile, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "elapsed": elapsed,
+                "config": vars(args),
+                "summary": summary,
+                "stages": stages,
+                "title_fast_path": fast_path,
+            },
+            f,
+            indent=2,
+        )
+    print(f"{len(samples)} requests in {elapsed:.2f} seconds, saved to {outfile}")
+
+
+if __name__ == "__main__":
+    main()
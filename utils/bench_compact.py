@@ -0,0 +1,168 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+from bench_index import key_id, knn, percentiles, recall, wait_for_indexing
+from load_redis import get_redis_conn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from index_profiles import build_index, index_target
+from projection import Projection
+
+# Copies the loaded movie:* documents with their embeddings projected onto
+# fewer dims under bench{dims}:movie:*, indexes each copy and compares it
+# with the float32 index the documents were loaded with: memory per document
+# (JSON document and vector index), KNN latency and recall@k. With --check a
+# copy at the full dims through an identity projection is benchmarked first,
+# it has to find exactly what the float32 index finds.
+
+
+def read_embeddings(r, keys, batch_size=500):
+    embeddings = []
+    for pos in range(0, len(keys), batch_size):
+        pipe = r.pipeline(transaction=False)
+        for key in keys[pos : pos + batch_size]:
+            pipe.json().get(key, "$.embedding")
+        embeddings += [v[0] for v in pipe.execute()]
+    return np.array(embeddings, dtype=np.float32)
+
+
+def copy_projected(r, keys, live_prefix, prefix, projection, batch_size=200):
+    for pos in range(0, len(keys), batch_size):
+        batch = keys[pos : pos + batch_size]
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            pipe.json().get(key, "$")
+        docs = [v[0] for v in pipe.execute()]
+        projected = projection.transform([doc["embedding"] for doc in docs])
+        pipe = r.pipeline(transaction=False)
+        for key, doc, embedding in zip(batch, docs, projected):
+            doc["embedding"] = embedding.tolist()
+            pipe.json().set(f"{prefix}:{key_id(key, live_prefix)}", "$", doc)
+        pipe.execute()
+
+
+def memory_per_doc(r, index_name, keys):
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key, samples=0)
+    doc_bytes = np.mean([m or 0 for m in pipe.execute()])
+    info = r.ft(index_name).info()
+    vector_bytes = float(info["vector_index_sz_mb"]) * 1024 * 1024
+    return doc_bytes, vector_bytes / max(int(info["num_docs"]), 1)
+
+
+def bench_copy(r, args, keys, live_prefix, memory_keys, queries, truth, projection):
+    """Copy `keys` through `projection` under their own prefix and index, and
+    return its row of the table."""
+    start, dims = time.time(), projection.dims_out
+    name, prefix = f"movies_bench_{dims}", f"bench{dims}:{live_prefix}"
+    index = build_index(args.index, profile="flat", name=name, prefix=prefix, dims=dims)
+    index.set_client(r)
+    index.create(overwrite=True, drop=True)
+    copy_projected(r, keys, live_prefix, prefix, projection)
+    wait_for_indexing(r, name)
+    print(f"{dims} dims: copied and indexed in {time.time() - start:.1f}s")
+
+    results, latencies = [], []
+    for vector in projection.transform(queries):
+        ids, latency = knn(r, name, vector.tobytes(), args.k)
+        results.append([key_id(i, prefix) for i in ids])
+        latencies.append(latency)
+
+    copies = [f"{prefix}:{key_id(key, live_prefix)}" for key in memory_keys]
+    doc_bytes, vector_bytes = memory_per_doc(r, name, copies)
+    if not args.keep:
+        # drops the copies along with their index
+        index.delete(drop=True)
+    return (
+        str(dims),
+        f"{doc_bytes / 1024:.2f}",
+        f"{vector_bytes / 1024:.2f}",
+        f"{recall(results, truth):.3f}",
+        *percentiles(latencies),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory, latency and recall of projected embeddings against float32"
+    )
+    parser.add_argument("--index", default="movie_index.yaml")
+    parser.add_argument("--dims", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--fit-sample", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--memory-sample", type=int, default=500)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="Keep the copies")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Fail unless a full dims copy has recall 1.0 against float32",
+    )
+    args = parser.parse_args()
+
+    r = get_redis_conn()
+    base = build_index(args.index, profile="flat")
+    _, live_prefix = index_target(r, base.name) or (base.name, base.prefix)
+    keys = sorted(r.scan_iter(match=f"{live_prefix}:*", _type="ReJSON-RL", count=1000))
+    rng = np.random.default_rng(0)
+    query_keys = list(rng.choice(keys, min(args.queries, len(keys)), replace=False))
+    memory_keys = list(
+        rng.choice(keys, min(args.memory_sample, len(keys)), replace=False)
+    )
+    fit_keys = list(rng.choice(keys, min(args.fit_sample, len(keys)), replace=False))
+
+    queries = read_embeddings(r, query_keys)
+    truth, latencies = [], []
+    for vector in queries:
+        ids, latency = knn(r, base.name, vector.tobytes(), args.k)
+        truth.append(set(key_id(i, live_prefix) for i in ids))
+        latencies.append(latency)
+
+    table = Table(
+        "dims",
+        "doc KB",
+        "vector index KB/doc",
+        f"recall@{args.k}",
+        "p50 ms",
+        "p99 ms",
+        title=f"{len(keys)} documents, {len(queries)} queries",
+    )
+    doc_bytes, vector_bytes = memory_per_doc(r, base.name, memory_keys)
+    table.add_row(
+        f"{queries.shape[1]} (float32)",
+        f"{doc_bytes / 1024:.2f}",
+        f"{vector_bytes / 1024:.2f}",
+        "1.000",
+        *percentiles(latencies),
+    )
+
+    sample = read_embeddings(r, fit_keys)
+    if args.check:
+        # same vectors under new keys, anything short of 1.0 is the bench
+        identity = Projection(np.eye(queries.shape[1], dtype=np.float32))
+        row = bench_copy(
+            r, args, keys, live_prefix, memory_keys, queries, truth, identity
+        )
+        table.add_row(f"{row[0]} (check)", *row[1:])
+        if row[3] != "1.000":
+            print(table)
+            raise SystemExit(f"Full dims copy has recall {row[3]}, expected 1.000")
+    for dims in args.dims:
+        projection = Projection.fit(sample, dims)
+        table.add_row(
+            *bench_copy(
+                r, args, keys, live_prefix, memory_keys, queries, truth, projection
+            )
+        )
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
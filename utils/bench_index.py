@@ -0,0 +1,214 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from redis.commands.search.query import Query
+from rich import print
+from rich.table import Table
+
+from load_redis import get_redis_conn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from index_profiles import build_index, index_target
+from vector_engine import VectorEngine
+
+# Builds a flat and an approximate index side by side over the documents of
+# the live movie index (the one its name or alias points at), runs the same
+# KNN queries on both and reports recall@k of the approximate index against
+# the exact (flat) results, plus latency. With --oracle the exact results
+# come from the in-process NumPy engine over a sidecar instead, and the flat
+# index is scored against it as well.
+
+
+def wait_for_indexing(r, name, timeout=1800):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        info = r.ft(name).info()
+        if float(info["percent_indexed"]) >= 1 and int(info["indexing"]) == 0:
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f"Index {name} still indexing after {timeout} seconds")
+
+
+def sample_queries(r, prefix, n, seed=0):
+    keys = list(r.scan_iter(match=f"{prefix}:*", _type="ReJSON-RL", count=1000))
+    keys = random.Random(seed).sample(keys, min(n, len(keys)))
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.json().get(key, "$.embedding")
+    return [np.array(v[0], dtype=np.float32).tobytes() for v in pipe.execute()]
+
+
+def knn(r, index_name, vector, k, ef_runtime=None):
+    ef = f" EF_RUNTIME {ef_runtime}" if ef_runtime else ""
+    q = (
+        Query(f"*=>[KNN {k} @embedding $vector{ef} AS vector_distance]")
+        .sort_by("vector_distance")
+        .return_fields("vector_distance")
+        .paging(0, k)
+        .dialect(2)
+    )
+    start = time.perf_counter()
+    result = r.ft(index_name).search(q, query_params={"vector": vector})
+    return [doc.id for doc in result.docs], time.perf_counter() - start
+
+
+def key_id(key, prefix) -> str:
+    # the document id of `key`, without the whole index prefix, which may
+    # itself contain colons, e.g. v3:movie after a rebuild
+    return key[len(prefix) + 1 :] if key.startswith(f"{prefix}:") else key
+
+
+def oracle_knn(engine, vector, k):
+    start = time.perf_counter()
+    rows, _ = engine.search(np.frombuffer(vector, dtype=np.float32), k)
+    ids = [f"{engine.prefix}:{engine.ids[row]}" for row in rows]
+    return ids, time.perf_counter() - start
+
+
+def data_profiles(indexfile, profile) -> list:
+    # the profiles of `profile` that do not pick the algorithm, e.g. pca256
+    # of "hnsw,pca256", both bench indexes need them to fit the documents
+    names = []
+    for name in (profile or "").split(","):
+        name = name.strip()
+        if name in ("", "flat"):
+            continue
+        attrs = build_index(indexfile, profile=name).schema.fields["embedding"].attrs
+        if attrs.algorithm.value == "FLAT":
+            names.append(name)
+    return names
+
+
+def build(r, indexfile, profile, name, **overrides):
+    index = build_index(indexfile, profile=profile, name=name, **overrides)
+    index.set_client(r)
+    start = time.time()
+    index.create(overwrite=True)
+    wait_for_indexing(r, name)
+    return index, time.time() - start
+
+
+def recall(results, truth):
+    return np.mean(
+        [
+            len(expected.intersection(ids)) / max(len(expected), 1)
+            for ids, expected in zip(results, truth)
+        ]
+    )
+
+
+def percentiles(latencies):
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    return f"{p50:.2f}", f"{p99:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recall@k and latency of an approximate index profile against flat"
+    )
+    parser.add_argument("--index", default="movie_index.yaml")
+    parser.add_argument(
+        "--profile",
+        default="hnsw",
+        help="Approximate profile to benchmark, combined with the dims and projection "
+        "profiles of --data-profile",
+    )
+    parser.add_argument(
+        "--data-profile",
+        help="Profile the documents were loaded with, defaults to index_profile in "
+        "app.config",
+    )
+    parser.add_argument("--m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--ef-runtime", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument(
+        "--oracle", help="Sidecar directory to take the exact results from"
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the bench indexes")
+    args = parser.parse_args()
+
+    r = get_redis_conn()
+    data = data_profiles(args.index, args.data_profile or os.getenv("index_profile"))
+    flat_profile = ",".join(["flat"] + data)
+    approx_profile = ",".join(
+        [args.profile] + [p for p in data if p not in args.profile.split(",")]
+    )
+    # the key prefix of the live index, e.g. v3:movie after a rebuild
+    base = build_index(args.index, profile=flat_profile)
+    _, prefix = index_target(r, base.name) or (base.name, base.prefix)
+    flat, flat_build = build(
+        r, args.index, flat_profile, "movies_bench_flat", prefix=prefix
+    )
+    approx, approx_build = build(
+        r,
+        args.index,
+        approx_profile,
+        f"movies_bench_{args.profile.replace(',', '_')}",
+        prefix=prefix,
+        m=args.m,
+        ef_construction=args.ef_construction,
+    )
+    print(
+        f"Indexes built: {flat_profile} {flat_build:.1f}s, "
+        f"{approx_profile} {approx_build:.1f}s"
+    )
+
+    queries = sample_queries(r, prefix, args.queries)
+    truth, flat_results, flat_latencies, oracle_latencies = [], [], [], []
+    engine = VectorEngine(args.oracle, args.index, prefix) if args.oracle else None
+    for vector in queries:
+        ids, latency = knn(r, flat.name, vector, args.k)
+        flat_results.append(ids)
+        flat_latencies.append(latency)
+        if engine:
+            ids, latency = oracle_knn(engine, vector, args.k)
+            oracle_latencies.append(latency)
+        truth.append(set(ids))
+
+    attrs = approx.schema.fields["embedding"].attrs
+    hnsw = attrs.algorithm.value == "HNSW"
+    table = Table(
+        "index",
+        "ef_runtime",
+        f"recall@{args.k}",
+        "p50 ms",
+        "p99 ms",
+        title=f"{len(queries)} queries, M={getattr(attrs, 'm', '-')}, "
+        f"EF_CONSTRUCTION={getattr(attrs, 'ef_construction', '-')}",
+    )
+    if engine:
+        table.add_row("numpy", "-", "1.000", *percentiles(oracle_latencies))
+    table.add_row(
+        "flat",
+        "-",
+        f"{recall(flat_results, truth):.3f}",
+        *percentiles(flat_latencies),
+    )
+    for ef_runtime in args.ef_runtime if hnsw else [None]:
+        results, latencies = [], []
+        for vector in queries:
+            ids, latency = knn(r, approx.name, vector, args.k, ef_runtime)
+            results.append(ids)
+            latencies.append(latency)
+        table.add_row(
+            approx_profile,
+            str(ef_runtime or "-"),
+            f"{recall(results, truth):.3f}",
+            *percentiles(latencies),
+        )
+    print(table)
+
+    if not args.keep:
+        for index in (flat, approx):
+            # drop the bench indexes only, the movie documents stay
+            r.ft(index.name).dropindex(delete_documents=False)
+
+
+if __name__ == "__main__":
+    main()
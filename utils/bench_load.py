@@ -0,0 +1,100 @@
+import argparse
+import ast
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+from rich import print
+from rich.table import Table
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from sidecar_format import Sidecar, parse_embeddings, prepare_metadata
+
+# Each source is read in its own subprocess so peak RSS is not shared
+# between runs. Only the read/parse side is measured, nothing goes to redis.
+
+
+def read_csv_full(args):
+    df = pd.read_csv(args.data)
+    embeddings = df.pop("embedding").apply(ast.literal_eval)
+    df = prepare_metadata(df)
+    df["embedding"] = embeddings
+    return len(df.to_dict(orient="records"))
+
+
+def read_csv_stream(args):
+    docs = 0
+    for chunk in pd.read_csv(args.data, chunksize=args.chunk_size):
+        # parsed for the timing only, nothing is loaded
+        parse_embeddings(chunk.pop("embedding"), args.dims)
+        docs += len(prepare_metadata(chunk).to_dict(orient="records"))
+    return docs
+
+
+def read_sidecar(args):
+    docs = 0
+    for records, embeddings in Sidecar(args.sidecar).iter_chunks(args.chunk_size):
+        embeddings.sum()  # touch the mapped pages
+        docs += len(records)
+    return docs
+
+
+SOURCES = {
+    "csv": read_csv_full,
+    "csv-stream": read_csv_stream,
+    "sidecar": read_sidecar,
+}
+
+
+def run_one(args):
+    start_time = time.perf_counter()
+    docs = SOURCES[args.run](args)
+    elapsed = time.perf_counter() - start_time
+    # ru_maxrss is in KB on linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result = {"docs": docs, "seconds": elapsed, "peak_rss_mb": peak_mb}
+    sys.stdout.write(json.dumps(result) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare csv and sidecar load time and peak memory"
+    )
+    parser.add_argument("--data", default="utils/data_with_embeddings.csv")
+    parser.add_argument("--sidecar", default="utils/data_sidecar")
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--sources", nargs="+", default=list(SOURCES))
+    parser.add_argument("--run", choices=SOURCES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run_one(args)
+
+    table = Table("source", "docs", "seconds", "docs/s", "peak RSS (MB)")
+    for source in args.sources:
+        out = subprocess.run(
+            [sys.executable, __file__, "--run", source]
+            + ["--data", args.data, "--sidecar", args.sidecar]
+            + ["--dims", str(args.dims), "--chunk-size", str(args.chunk_size)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        table.add_row(
+            source,
+            str(result["docs"]),
+            f"{result['seconds']:.2f}",
+            f"{result['docs'] / result['seconds']:.0f}",
+            f"{result['peak_rss_mb']:.0f}",
+        )
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
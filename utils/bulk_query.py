@@ -0,0 +1,220 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+
+from rich import print
+from rich.progress import Progress
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.append(APP_DIR)
+
+# Runs Find My Movies lookups and Recommendations queries for a JSONL file of
+# requests, with the same query building and planning as the pages
+# (app/pipelines.py). Each line is one request:
+#   {"id": "a1", "path": "find_movies", "prompt": "...", "num_results": 10}
+#   {"id": "a2", "path": "recommendations", "overview": "...", "genres": "drama",
+#    "filters": {"popularity_val": 10, "vote_avg_val": 6.5}}
+# Lines are taken in batches, each batch is embedded with one call and its
+# KNN queries sent in one pipelined round trip, on a pool of worker
+# processes. Results are written in input order to a JSONL file, one line per
+# request, and a checkpoint next to it records how far the output is
+# complete, so an interrupted run picks up from there.
+
+
+def run_batch(batch):
+    """Embed and query one batch of input lines in this process. Return the
+    number of its first line, its line count and its output records."""
+    import pipelines
+    from resources import get_index, get_replica, get_vectorizer
+    from search import knn
+
+    start, lines, embed_batch_size = batch
+    requests, records = [], []
+    for n, line in enumerate(lines, start):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if request.get("path") not in ("find_movies", "recommendations"):
+                raise ValueError(f"Unknown path {request.get('path')!r}")
+            unknown = set(request.get("filters", {})) - set(pipelines.RECOMMEND_FILTERS)
+            if unknown:
+                raise ValueError(
+                    f"Unknown filters {sorted(unknown)}, expected some of "
+                    f"{list(pipelines.RECOMMEND_FILTERS)}"
+                )
+        except ValueError as e:
+            records.append({"line": n, "error": str(e)})
+            continue
+        record = {"id": request.get("id", n), "line": n, "path": request["path"]}
+        requests.append((record, request))
+        records.append(record)
+    if not requests:
+        return start, len(lines), records
+
+    texts = [
+        (
+            r.get("prompt", "")
+            if r["path"] == "find_movies"
+            else r.get("overview") or pipelines.DEFAULT_OVERVIEW
+        )
+        for _, r in requests
+    ]
+    vectors = get_vectorizer().embed_many(texts, batch_size=embed_batch_size)
+
+    find, recommend = [], []
+    for (record, request), vector in zip(requests, vectors):
+        is_find = request["path"] == "find_movies"
+        (find if is_find else recommend).append((record, request, vector))
+
+    if find:
+        queries = [pipelines.find_query(v, r.get("num_results", 3)) for _, r, v in find]
+        results = knn(get_index(), queries, get_replica())
+        for (record, _, _), docs in zip(find, results):
+            record["results"] = docs
+
+    if recommend:
+        plans, ks = [], []
+        for _, r, _ in recommend:
+            k = r.get("num_results", 3)
+            plans.append(
+                pipelines.plan_recommendation(
+                    get_index(), r.get("genres", "*"), k, **r.get("filters", {})
+                )
+            )
+            ks.append(k)
+        answers = pipelines.recommend_many([v for _, _, v in recommend], plans, ks)
+        for (record, _, _), (_, docs, query_plan) in zip(recommend, answers):
+            # the fields fetched only to post-filter on are not part of the result
+            record["results"] = [
+                {k: v for k, v in doc.items() if not k.startswith("$.")} for doc in docs
+            ]
+            record["plan"] = str(query_plan)
+    return start, len(lines), records
+
+
+def read_batches(path, skip, batch_size, embed_batch_size):
+    with open(path) as f:
+        batch, start = [], skip
+        for n, line in enumerate(f):
+            if n < skip:
+                continue
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield start, batch, embed_batch_size
+                batch, start = [], n + 1
+        if batch:
+            yield start, batch, embed_batch_size
+
+
+class Checkpoint:
+    """Number of input lines, and bytes of output, known to be complete."""
+
+    def __init__(self, output, data):
+        self.path = f"{output}.checkpoint"
+        self.data = data
+
+    def load(self, restart=False) -> dict:
+        if restart or not os.path.exists(self.path):
+            return {"lines": 0, "bytes": 0}
+        with open(self.path) as f:
+            saved = json.load(f)
+        if saved["data"] != self.data:
+            raise ValueError(
+                f"{self.path} is for {saved['data']}, not {self.data}; "
+                f"use --restart to start over"
+            )
+        return saved
+
+    def save(self, lines, size):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"data": self.data, "lines": lines, "bytes": size}, f)
+        os.replace(tmp, self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run lookups and recommendations for a JSONL file of requests"
+    )
+    parser.add_argument("--data", required=True, help="JSONL file of requests")
+    parser.add_argument("--out", required=True, help="JSONL file of results")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--batch-size", type=int, default=256, help="Input lines per batch"
+    )
+    parser.add_argument(
+        "--embed-batch-size",
+        type=int,
+        default=256,
+        help="Texts per call to the embedding API",
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore the checkpoint and start over"
+    )
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.out, os.path.abspath(args.data))
+    state = checkpoint.load(args.restart)
+    with open(args.data) as f:
+        total = sum(1 for _ in f)
+    if state["lines"]:
+        print(f"Resuming after line {state['lines']} of {total}")
+
+    # output past the checkpoint is from a run that did not finish its batch
+    out = open(args.out, "r+b" if state["lines"] else "wb")
+    out.truncate(state["bytes"])
+    out.seek(state["bytes"])
+
+    def write(result):
+        start, count, records = result
+        out.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in records))
+        out.flush()
+        os.fsync(out.fileno())
+        checkpoint.save(start + count, out.tell())
+        return count
+
+    batches = read_batches(
+        args.data, state["lines"], args.batch_size, args.embed_batch_size
+    )
+    done, start_time = state["lines"], time.time()
+    with Progress() as progress:
+        task = progress.add_task("Querying", total=total, completed=done)
+
+        def advance(count):
+            nonlocal done
+            done += count
+            rate = (done - state["lines"]) / (time.time() - start_time)
+            progress.update(
+                task, completed=done, description=f"Queried {done} ({rate:.0f}/s)"
+            )
+
+        if args.workers <= 1:
+            for batch in batches:
+                advance(write(run_batch(batch)))
+        else:
+            # spawned, so every worker builds its own clients and connections;
+            # at most two batches per worker in flight, written in input order
+            with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+                pending = deque()
+                for batch in batches:
+                    pending.append(pool.apply_async(run_batch, (batch,)))
+                    if len(pending) >= 2 * args.workers:
+                        advance(write(pending.popleft().get()))
+                while pending:
+                    advance(write(pending.popleft().get()))
+    out.close()
+
+    elapsed = time.time() - start_time
+    print(
+        f"{done - state['lines']} requests in {elapsed:.2f} seconds, "
+        f"results in {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,27 @@
 import pandas as pd
+import numpy as np
 import redis
 from rich import print
+from rich.progress import Progress
+import argparse
 import ast
-from redisvl.index import SearchIndex
+import hashlib
+import json
 import time
 from dotenv import load_dotenv
 import os
+import sys
+import tempfile
+
+# shared modules of the streamlit app live in app/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from index_profiles import build_index, index_projection, index_target
+from neighbours import DEFAULT_K, entry, top_neighbours
+from projection import Projection
+from result_cache import bump_version
+from shards import RoutedPipeline, ShardedIndex, shard_endpoints
+from sidecar_format import Sidecar, parse_embeddings, prepare_metadata
+from titles import add_title, build_dictionary, dictionary_key
 
 load_dotenv(dotenv_path="app.config")
 
@@ -30,40 +46,586 @@ def get_redis_conn() -> redis.Redis:
     return r
 
 
+def get_shard_conns() -> list:
+    # one connection per endpoint in redis_shards, none when not sharded
+    return [
+        redis.Redis(
+            host=host,
+            port=port,
+            username=os.getenv("redis_user") or None,
+            password=os.getenv("redis_pass") or None,
+            decode_responses=True,
+        )
+        for host, port in shard_endpoints()
+    ]
+
+
 def dataframe_to_json(df: pd.DataFrame):
-    records = df.to_dict(orient="records")
+    # missing numbers as None, and plain python values, so a document hashes
+    # the same whichever dtypes pandas picked for its chunk
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
     return [dict(record) for record in records]
 
 
-def create_index(r, indexfile, datafile):
-    # Clean existing data
-    r.flushdb()
-    print("Existing data deleted from redis")
-
-    # Preprocess data
-    print("Data preprocessing started")
-    df = pd.read_csv(datafile).fillna(value="")
-    df["genres"] = df["genres"].apply(ast.literal_eval)
-    df["embedding"] = df["embedding"].apply(ast.literal_eval)
-    list_docs = dataframe_to_json(df)
-    print("Data preprocessing complete")
-
-    # construct a search index from the yaml file
-    jindex = SearchIndex.from_yaml(indexfile)
-    jindex.set_client(client=r)
-    jindex.create(overwrite=True)
-    print("Index created")
-    jindex.load(list_docs, id_field="id")
+def iter_csv_chunks(datafile, dims, chunk_size=1000):
+    # yields (records, embeddings, bytes read so far) one csv chunk at a time
+    with open(datafile, "rb") as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_size):
+            # float64 so the JSON written keeps the exact values of the csv
+            embeddings = parse_embeddings(chunk.pop("embedding"), dims, np.float64)
+            yield dataframe_to_json(prepare_metadata(chunk)), embeddings, f.tell()
+
+
+def iter_sidecar_chunks(sidecar, chunk_size=1000):
+    bytes_per_row = sidecar.dims * sidecar.embeddings.itemsize
+    rows = 0
+    for records, embeddings in sidecar.iter_chunks(chunk_size):
+        rows += len(records)
+        yield records, embeddings, rows * bytes_per_row
+
+
+def fit_projection(chunks, dims, sample_size):
+    # fits on the first sample_size rows, and yields every chunk back
+    buffered, sample = [], []
+    for chunk in chunks:
+        buffered.append(chunk)
+        sample.append(chunk[1])
+        if sum(len(e) for e in sample) >= sample_size:
+            break
+    projection = Projection.fit(np.concatenate(sample)[:sample_size], dims)
+
+    def replay():
+        yield from buffered
+        yield from chunks
+
+    return projection, replay()
+
+
+def project_chunks(chunks, projection):
+    for records, embeddings, bytes_read in chunks:
+        yield records, projection.transform(embeddings), bytes_read
+
+
+def content_hash(record) -> str:
+    # embedding included, so re-embedded movies count as changed
+    return hashlib.sha1(
+        json.dumps(record, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def hashes_key(index_name) -> str:
+    # id -> content hash of every document loaded into the index from the
+    # source data, movies saved from Movie Maker are not in it
+    return f"sync:{index_name}"
+
+
+def collecting(chunks, graph, spill=None):
+    # keeps the id and title of every document for the title dictionary, and
+    # appends its embedding to the file `spill` for the neighbours, so memory
+    # stays bounded by the chunk size
+    for records, embeddings, bytes_read in chunks:
+        graph["ids"] += [record["id"] for record in records]
+        graph["titles"] += [record["original_title"] for record in records]
+        if spill is not None:
+            spill.write(np.asarray(embeddings, dtype=np.float32).tobytes())
+        yield records, embeddings, bytes_read
+
+
+def store_titles(r, jindex, graph) -> str:
+    """Write the title dictionary (app/titles.py) of the loaded documents
+    next to the live one, and return its key."""
+    key = f"{dictionary_key(jindex.name)}:next"
+    keys = (jindex.key(doc_id) for doc_id in graph["ids"])
+    titles = build_dictionary(r, key, zip(keys, graph["titles"]))
+    print(f"Title dictionary of {titles} titles built")
+    return key
+
+
+def store_neighbours(jindex, graph, vectors, k, block_size=1024, only_changed=False):
+    """Write the `k` most similar documents of every loaded document into
+    its $.similar, see app/neighbours.py. `vectors` has a row per id in
+    graph["ids"] and can be a memmap. With `only_changed` the lists are
+    read first and only the ones that differ are written."""
+    ids, titles = graph["ids"], graph["titles"]
+    start_time, written = time.time(), 0
+
+    with Progress() as progress:
+        task = progress.add_task("Computing neighbours", total=len(ids))
+        for start, rows, scores in top_neighbours(vectors, k, block_size=block_size):
+            lists = {
+                i: [entry(ids[j], titles[j], s) for j, s in zip(row, score)]
+                for i, (row, score) in enumerate(zip(rows, scores), start)
+            }
+            if only_changed:
+                # sync only, which does not shard, so a plain pipeline reads them
+                pipe = jindex.client.pipeline(transaction=False)
+                for i in lists:
+                    pipe.json().get(jindex.key(ids[i]), "$.similar")
+                for i, current in zip(list(lists), pipe.execute()):
+                    if current and current[0] == lists[i]:
+                        del lists[i]
+            pipe = RoutedPipeline(jindex)
+            for i, similar in lists.items():
+                pipe.route(ids[i]).json().set(jindex.key(ids[i]), "$.similar", similar)
+            pipe.execute()
+            written += len(lists)
+            progress.update(task, advance=len(rows))
+
+    print(
+        f"Stored the {k} nearest neighbours of {written} of {len(ids)} docs in "
+        f"{time.time() - start_time:.2f} seconds"
+    )
+
+
+def stream_load(r, jindex, chunks, total_bytes, batch_size=200):
+    docs, start_time = 0, time.time()
+    hashes = hashes_key(jindex.name)
+
+    with Progress() as progress:
+        task = progress.add_task("Loading documents", total=total_bytes)
+        for records, embeddings, bytes_read in chunks:
+            for pos in range(0, len(records), batch_size):
+                # on a sharded index every document, and its hash, goes to
+                # the shard of its id
+                pipe = RoutedPipeline(jindex)
+                for record, embedding in zip(
+                    records[pos : pos + batch_size],
+                    embeddings[pos : pos + batch_size],
+                ):
+                    record["embedding"] = embedding.tolist()
+                    shard = pipe.route(record["id"])
+                    shard.json().set(jindex.key(record["id"]), "$", record)
+                    shard.hset(hashes, record["id"], content_hash(record))
+                pipe.execute()
+
+            docs += len(records)
+            elapsed = time.time() - start_time
+            progress.update(
+                task,
+                completed=bytes_read,
+                description=f"Loaded {docs} docs ({docs / elapsed:.0f} docs/s, "
+                f"{bytes_read / elapsed / 1e6:.1f} MB/s)",
+            )
+
+    elapsed = time.time() - start_time
+    print(
+        f"Streamed {docs} docs in {elapsed:.2f} seconds "
+        f"({docs / elapsed:.0f} docs/s, {total_bytes / elapsed / 1e6:.1f} MB/s)"
+    )
+
+
+def sync_load(r, jindex, chunks, total_bytes, batch_size=200):
+    """Write the documents that are new or changed since they were last
+    loaded, by content hash, and delete the ones no longer in the source.
+    Documents that did not come from the source are left alone."""
+    hashes = hashes_key(jindex.name)
+    known = r.hgetall(hashes)
+    seen, written = set(), 0
+
+    with Progress() as progress:
+        task = progress.add_task("Syncing documents", total=total_bytes)
+        for records, embeddings, bytes_read in chunks:
+            pipe = r.pipeline(transaction=False)
+            for record, embedding in zip(records, embeddings):
+                record["embedding"] = embedding.tolist()
+                doc_id, digest = str(record["id"]), content_hash(record)
+                seen.add(doc_id)
+                if known.get(doc_id) != digest:
+                    pipe.json().set(jindex.key(doc_id), "$", record)
+                    pipe.hset(hashes, doc_id, digest)
+                    written += 1
+                if len(pipe) >= 2 * batch_size:
+                    pipe.execute()
+            pipe.execute()
+            progress.update(
+                task,
+                completed=bytes_read,
+                description=f"Checked {len(seen)} docs, {written} written",
+            )
+
+    removed = sorted(set(known) - seen)
+    for pos in range(0, len(removed), batch_size):
+        batch = removed[pos : pos + batch_size]
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(*[jindex.key(doc_id) for doc_id in batch])
+        pipe.hdel(hashes, *batch)
+        pipe.execute()
+
+    if written or removed:
+        bump_version(r)
+    print(
+        f"Synced {len(seen)} docs: {written} new or changed, {len(removed)} removed, "
+        f"{len(seen) - written} unchanged"
+    )
+    return written, len(removed)
+
+
+def carry_over(r, live, target, titles, batch_size=200):
+    # copies the documents of the live index that are not from the source
+    # (movies saved from Movie Maker) into the rebuilt one and its title
+    # dictionary `titles`
+    name, prefix = live
+    source = set(r.hkeys(hashes_key(target.name)))
+    dims = target.schema.fields["embedding"].attrs.dims
+    keys = [
+        key
+        for key in r.scan_iter(match=f"{prefix}:*", _type="ReJSON-RL", count=1000)
+        if key[len(prefix) + 1 :] not in source
+    ]
+    copied = 0
+    for pos in range(0, len(keys), batch_size):
+        batch = keys[pos : pos + batch_size]
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            pipe.json().get(key, "$")
+        docs = [v[0] for v in pipe.execute()]
+        pipe = r.pipeline(transaction=False)
+        for key, doc in zip(batch, docs):
+            if len(doc.get("embedding", [])) != dims:
+                continue
+            pipe.json().set(target.key(key[len(prefix) + 1 :]), "$", doc)
+            copied += 1
+        pipe.execute()
+        for key, doc in zip(batch, docs):
+            if len(doc.get("embedding", [])) == dims:
+                add_title(
+                    r,
+                    titles,
+                    doc.get("original_title", ""),
+                    target.key(key[len(prefix) + 1 :]),
+                )
+    print(f"Carried over {copied} of {len(keys)} docs not in the source from {name}")
+
+
+def collect_unsourced(r, jindex, graph, spill, batch_size=200):
+    # adds the documents of the index that are not from the source (movies
+    # saved from Movie Maker) to `graph` and their embeddings to `spill`, so
+    # a sync keeps them in the lists of neighbours and the title dictionary
+    prefix = jindex.prefix
+    source = set(r.hkeys(hashes_key(jindex.name)))
+    dims = jindex.schema.fields["embedding"].attrs.dims
+    keys = [
+        key
+        for key in r.scan_iter(match=f"{prefix}:*", _type="ReJSON-RL", count=1000)
+        if key[len(prefix) + 1 :] not in source
+    ]
+    added = 0
+    for pos in range(0, len(keys), batch_size):
+        batch = keys[pos : pos + batch_size]
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            pipe.json().get(key, "$")
+        for key, value in zip(batch, pipe.execute()):
+            doc = value[0] if value else {}
+            if len(doc.get("embedding", [])) != dims:
+                continue
+            graph["ids"].append(doc.get("id", key[len(prefix) + 1 :]))
+            graph["titles"].append(doc.get("original_title", ""))
+            if spill is not None:
+                spill.write(np.asarray(doc["embedding"], dtype=np.float32).tobytes())
+            added += 1
+    print(f"Kept {added} of {len(keys)} docs not in the source")
+
+
+def clear_llmcache(r, batch_size=1000):
+    # both tiers and the LRU set of the app's prompt cache, its index and
+    # the model it was built for stay
+    keys = [
+        key
+        for key in r.scan_iter(match="llmcache:*", count=batch_size)
+        if key != "llmcache:model"
+    ]
+    for pos in range(0, len(keys), batch_size):
+        r.delete(*keys[pos : pos + batch_size])
+    print(f"Cleared {len(keys)} prompt cache keys")
+
+
+def swap_alias(r, alias, live, target, keep_old=False, titles=None):
+    """Point `alias` at `target`, retiring cached results and replacing the
+    title dictionary with `titles` in the same transaction, and drop the
+    index it pointed at unless `keep_old`."""
+    pipe = r.pipeline(transaction=True)
+    if live is not None and live[0] == alias:
+        # first rebuild after a reset load, that index holds the name the
+        # alias takes over so it has to go first
+        pipe.ft(alias).dropindex(delete_documents=True)
+        pipe.delete(hashes_key(alias))
+    pipe.ft(target.name).aliasupdate(alias)
+    pipe.delete(f"planner:stats:{alias}", dictionary_key(alias))
+    if titles and r.exists(titles):
+        pipe.rename(titles, dictionary_key(alias))
+    bump_version(pipe)
+    pipe.execute()
+    print(f"Alias {alias} now points at {target.name}")
+
+    if live is not None and live[0] != alias and not keep_old:
+        r.ft(live[0]).dropindex(delete_documents=True)
+        r.delete(hashes_key(live[0]))
+        print(f"Dropped {live[0]} and its documents")
+
+
+def create_index(
+    r,
+    indexfile,
+    datafile,
+    profile=None,
+    mode="reset",
+    stream=False,
+    sidecar=None,
+    chunk_size=1000,
+    batch_size=200,
+    source_dims=1536,
+    fit_sample=20000,
+    keep_old=False,
+    neighbours=DEFAULT_K,
+    shards=None,
+):
+    # construct a search index from the yaml file and the chosen vector profile
+    jindex = build_index(indexfile, profile=profile)
+    live = index_target(r, jindex.name)
+
+    if shards:
+        # the index and its share of the documents on every shard, the
+        # projection and the result version stay on r
+        if mode != "reset":
+            raise ValueError(f"--mode {mode} is not supported with redis_shards")
+        indexes = []
+        for client in shards:
+            shard_live = index_target(client, jindex.name)
+            if shard_live is not None:
+                client.ft(shard_live[0]).dropindex(delete_documents=True)
+                client.delete(hashes_key(shard_live[0]))
+            client.delete(f"planner:stats:{jindex.name}")
+            shard = build_index(indexfile, profile=profile)
+            shard.set_client(client=client)
+            indexes.append(shard)
+        target = ShardedIndex(indexes)
+        target.create(overwrite=True, drop=True)
+        print(f"Index created on {len(shards)} shards")
+    elif mode == "sync":
+        # in place, into whatever the name or alias currently points at
+        if live is None:
+            raise ValueError(f"No index {jindex.name} to sync, load it first")
+        target = build_index(indexfile, profile=profile, name=live[0], prefix=live[1])
+        target.set_client(client=r)
+    elif mode == "rebuild":
+        # next to the live index, under its own name and key prefix, the
+        # prefix must not start with the live one or that would index it too
+        build = r.incr(f"{jindex.name}:build")
+        target = build_index(
+            indexfile,
+            profile=profile,
+            name=f"{jindex.name}_v{build}",
+            prefix=f"v{build}:{jindex.prefix}",
+        )
+        target.set_client(client=r)
+        target.create(overwrite=True, drop=True)
+        print(f"Index {target.name} created")
+    else:
+        # Clean the existing index and its documents, and nothing else
+        if live is not None:
+            if live[0] != jindex.name:
+                r.ft(jindex.name).aliasdel(jindex.name)
+            r.ft(live[0]).dropindex(delete_documents=True)
+            r.delete(hashes_key(live[0]), f"planner:stats:{jindex.name}")
+            print(f"Index {live[0]} and its documents deleted from redis")
+        target = jindex
+        target.set_client(client=r)
+        target.create(overwrite=True, drop=True)
+        print("Index created")
+
+    dims = target.schema.fields["embedding"].attrs.dims
+    # with a projecting profile the data has source_dims, the index fewer
+    projected = index_projection(indexfile, profile) is not None
+    data_dims = source_dims if projected else dims
+
+    projection = None
+    if projected and mode != "reset":
+        # keep the projection the app queries with, as long as it fits
+        projection = Projection.load(r, jindex.name)
+        if projection and (projection.dims_in, projection.dims_out) != (
+            data_dims,
+            dims,
+        ):
+            projection = None
+        if projection is None and mode == "sync":
+            raise ValueError(f"No {data_dims} to {dims} dims projection to sync with")
+
+    if sidecar:
+        # Binary sidecar, nothing to parse, embeddings are sliced from a memmap
+        sc = Sidecar(sidecar)
+        if sc.dims != data_dims:
+            raise ValueError(f"Sidecar has {sc.dims} dims, expected {data_dims}")
+        chunks = iter_sidecar_chunks(sc, chunk_size=chunk_size)
+        total_bytes = sc.embeddings.nbytes
+    elif stream or mode == "sync":
+        # Preprocess and load chunk by chunk, memory stays bounded by chunk_size
+        chunks = iter_csv_chunks(datafile, data_dims, chunk_size=chunk_size)
+        total_bytes = os.path.getsize(datafile)
+    else:
+        chunks = None
+
+    graph, vectors, spill = {"ids": [], "titles": []}, None, None
+    if chunks is not None:
+        if projected:
+            if projection is None:
+                projection, chunks = fit_projection(chunks, dims, fit_sample)
+            print(f"Projecting embeddings from {projection.dims_in} to {dims} dims")
+            chunks = project_chunks(chunks, projection)
+        if neighbours and sidecar and not projected and mode != "sync":
+            # the rows of the sidecar, in load order, already on disk
+            vectors = sc.embeddings
+        elif neighbours:
+            # the loaded embeddings go to a temporary file rather than memory,
+            # a sync appends the ones of the documents not in the source
+            spill = tempfile.TemporaryFile(suffix=".f32")
+        chunks = collecting(chunks, graph, spill)
+        if mode == "sync":
+            changed = any(sync_load(r, target, chunks, total_bytes, batch_size))
+            collect_unsourced(r, target, graph, spill, batch_size=batch_size)
+        else:
+            stream_load(r, target, chunks, total_bytes, batch_size=batch_size)
+        if spill is not None:
+            spill.flush()
+            if graph["ids"]:
+                vectors = np.memmap(
+                    spill, dtype=np.float32, mode="r", shape=(len(graph["ids"]), dims)
+                )
+    else:
+        # Preprocess data
+        print("Data preprocessing started")
+        df = pd.read_csv(datafile)
+        embeddings = df.pop("embedding").apply(ast.literal_eval)
+        # typed as in the chunked paths, so sync finds the same hashes
+        df = prepare_metadata(df)
+        df["embedding"] = embeddings
+        if projected:
+            embeddings = np.array(df["embedding"].tolist(), dtype=np.float32)
+            if projection is None:
+                projection = Projection.fit(embeddings[:fit_sample], dims)
+            df["embedding"] = projection.transform(embeddings).tolist()
+        list_docs = dataframe_to_json(df)
+        print("Data preprocessing complete")
+        target.load(list_docs, id_field="id")
+        graph = {
+            "ids": [doc["id"] for doc in list_docs],
+            "titles": [doc["original_title"] for doc in list_docs],
+        }
+        if neighbours:
+            # the whole file is in memory on this path anyway
+            vectors = np.array(df["embedding"].tolist(), dtype=np.float32)
+        if not shards:
+            r.hset(
+                hashes_key(target.name),
+                mapping={doc["id"]: content_hash(doc) for doc in list_docs},
+            )
     print("Data Loaded")
 
-    print(jindex.info())
+    # a sync that wrote and removed nothing keeps the lists it has
+    if neighbours and graph["ids"] and (mode != "sync" or changed):
+        store_neighbours(
+            target, graph, vectors, neighbours, only_changed=mode == "sync"
+        )
+    if spill is not None:
+        spill.close()
+    titles = store_titles(r, target, graph)
+
+    if mode == "rebuild":
+        if live is not None:
+            carry_over(r, live, target, titles, batch_size=batch_size)
+        swap_alias(r, jindex.name, live, target, keep_old=keep_old, titles=titles)
+    else:
+        # sync and reset replace the dictionary as they go live
+        pipe = r.pipeline(transaction=True)
+        pipe.delete(dictionary_key(jindex.name))
+        if graph["ids"]:
+            pipe.rename(titles, dictionary_key(jindex.name))
+        pipe.execute()
+        if mode == "reset":
+            bump_version(r)
+    if projected and mode != "sync":
+        if Projection.stored_fingerprint(r, jindex.name) != projection.fingerprint:
+            # cached prompt vectors were projected with the previous one
+            clear_llmcache(r)
+        projection.save(r, jindex.name)
+
+    print(target.info())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load movies into redis")
+    parser.add_argument("--data", default="utils/data_with_embeddings.csv")
+    parser.add_argument("--index", default="movie_index.yaml")
+    parser.add_argument(
+        "--profile",
+        help="Vector index profile from the yaml file, defaults to index_profile in app.config",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["reset", "sync", "rebuild"],
+        default="reset",
+        help="reset: drop the index and its documents and load it again; "
+        "sync: write only new or changed documents and delete removed ones; "
+        "rebuild: load a new versioned index and switch the alias to it",
+    )
+    parser.add_argument(
+        "--keep-old",
+        action="store_true",
+        help="With --mode rebuild, keep the previous index and its documents",
+    )
+    parser.add_argument(
+        "--neighbours",
+        type=int,
+        default=DEFAULT_K,
+        help="Number of most similar movies stored with each document, 0 for none. "
+        "With --stream they are computed from the embeddings spilled to a temporary "
+        "file (rows x dims float32), with --sidecar from its memmap",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read the csv in chunks and write them with pipelined JSON.SET batches",
+    )
+    parser.add_argument(
+        "--sidecar",
+        help="Load from a sidecar directory written by utils/sidecar.py instead of the csv",
+    )
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument(
+        "--source-dims",
+        type=int,
+        default=1536,
+        help="Dims of the embeddings in the data, when the profile projects them",
+    )
+    parser.add_argument(
+        "--fit-sample",
+        type=int,
+        default=20000,
+        help="Number of embeddings the projection of a projecting profile is fitted on",
+    )
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     start_time = time.time()
-    filename = "utils/data_with_embeddings.csv"
-    indexfile = "movie_index.yaml"
-    create_index(r=get_redis_conn(), indexfile=indexfile, datafile=filename)
+    create_index(
+        r=get_redis_conn(),
+        indexfile=args.index,
+        datafile=args.data,
+        profile=args.profile,
+        mode=args.mode,
+        stream=args.stream,
+        sidecar=args.sidecar,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        source_dims=args.source_dims,
+        fit_sample=args.fit_sample,
+        keep_old=args.keep_old,
+        neighbours=args.neighbours,
+        shards=get_shard_conns(),
+    )
     print(f"Total time taken : {time.time() - start_time:.2f} seconds")
 
 
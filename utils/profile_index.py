@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from redis.commands.search.query import Query
+from redis.exceptions import ResponseError
+from rich import print
+from rich.table import Table
+
+from load_redis import get_redis_conn, get_shard_conns
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from index_profiles import index_target
+
+# Samples the health and size of the movie index and the llmcache semantic
+# cache every --interval seconds: FT.INFO counters, indexing progress, the
+# memory used by the keys of each index prefix, and the latency of a fixed
+# set of KNN probe queries. Every sample is appended as one JSON line per
+# index to --out, with the alerts of the thresholds it crossed, so growth and
+# latency can be followed over time and the switch to HNSW or to shards
+# planned before latency regresses. With redis_shards set, the movie index
+# of every shard is sampled.
+
+# FT.INFO fields kept in each sample, when the server reports them
+INFO_FIELDS = [
+    "num_docs",
+    "num_records",
+    "num_terms",
+    "vector_index_sz_mb",
+    "inverted_sz_mb",
+    "doc_table_size_mb",
+    "key_table_size_mb",
+    "sortable_values_size_mb",
+    "offset_vectors_sz_mb",
+    "total_indexing_time",
+    "percent_indexed",
+    "indexing",
+    "hash_indexing_failures",
+]
+
+
+def vector_field(info) -> dict:
+    """The attributes of the vector field of an FT.INFO reply."""
+    for attribute in info["attributes"]:
+        attrs = {str(k).lower(): v for k, v in zip(attribute[::2], attribute[1::2])}
+        if str(attrs.get("type")).upper() == "VECTOR":
+            return attrs
+    raise ValueError(f"Index {info['index_name']} has no vector field")
+
+
+def vector_dims(client, field, prefix, key_type) -> int:
+    # FT.INFO of older servers leaves the vector attributes out, then the
+    # dims are read off a stored vector
+    if field.get("dim"):
+        return int(field["dim"])
+    key = next(client.scan_iter(match=f"{prefix}:*", _type=key_type, count=1000), None)
+    if key is None:
+        return 0
+    if key_type == "ReJSON-RL":
+        return len(client.json().get(key, field["identifier"])[0])
+    width = 8 if str(field.get("data_type")).upper() == "FLOAT64" else 4
+    return client.hstrlen(key, field["identifier"]) // width
+
+
+def probes(dims, n, dtype=np.float32, seed=0) -> list:
+    # the same random unit vectors on every run, so latencies compare
+    vectors = np.random.default_rng(seed).standard_normal((n, dims))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [v.astype(dtype).tobytes() for v in vectors]
+
+
+def probe_latency(client, name, field, vectors, k) -> dict:
+    q = (
+        Query(f"*=>[KNN {k} @{field} $vector AS vector_distance]")
+        .sort_by("vector_distance")
+        .return_fields("vector_distance")
+        .paging(0, k)
+        .dialect(2)
+    )
+    latencies = []
+    for vector in vectors:
+        start = time.perf_counter()
+        client.ft(name).search(q, query_params={"vector": vector})
+        latencies.append((time.perf_counter() - start) * 1000)
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {"probe_p50_ms": p50, "probe_p95_ms": p95, "probe_max_ms": max(latencies)}
+
+
+def prefix_memory(client, prefix, key_type, sample) -> dict:
+    """Key count under `prefix`, and their memory estimated from the first
+    `sample` keys."""
+    keys, sampled = 0, []
+    for key in client.scan_iter(match=f"{prefix}:*", _type=key_type, count=1000):
+        keys += 1
+        if len(sampled) < sample:
+            sampled.append(key)
+    pipe = client.pipeline(transaction=False)
+    for key in sampled:
+        pipe.memory_usage(key)
+    sizes = [size or 0 for size in pipe.execute()]
+    per_key = sum(sizes) / len(sizes) if sizes else 0
+    return {"keys": keys, "memory_mb": per_key * keys / 1024 / 1024}
+
+
+def sample_index(client, label, name, args) -> dict:
+    target = index_target(client, name)
+    if target is None:
+        return {"index": label, "error": f"no index {name}"}
+    physical, prefix = target
+    info = client.ft(physical).info()
+    field = vector_field(info)
+    definition = info["index_definition"]
+    definition = dict(zip(definition[::2], definition[1::2]))
+    key_type = "ReJSON-RL" if definition.get("key_type") == "JSON" else "hash"
+
+    record = {"index": label, "physical": physical, "prefix": prefix}
+    record["algorithm"] = field.get("algorithm")
+    record["data_type"] = str(field.get("data_type", "FLOAT32")).upper()
+    record["dims"] = vector_dims(client, field, prefix, key_type)
+    for key in INFO_FIELDS:
+        if key in info:
+            record[key] = float(info[key])
+    record.update(prefix_memory(client, prefix, key_type, args.memory_sample))
+    # keys under the prefix the index has not (yet) picked up
+    record["unindexed_keys"] = max(record["keys"] - int(record.get("num_docs", 0)), 0)
+    if record.get("num_docs") and record["dims"]:
+        dtype = np.float64 if record["data_type"] == "FLOAT64" else np.float32
+        vectors = probes(record["dims"], args.probes, dtype)
+        record.update(
+            probe_latency(client, physical, field["attribute"], vectors, args.k)
+        )
+
+    memory = client.info("memory")
+    record["used_memory_mb"] = memory["used_memory"] / 1024 / 1024
+    record["maxmemory_mb"] = memory.get("maxmemory", 0) / 1024 / 1024
+    return record
+
+
+def alerts(record, baseline, args) -> list:
+    found = []
+    p95 = record.get("probe_p95_ms")
+    if p95 is not None and p95 > args.max_p95_ms:
+        found.append(f"probe p95 {p95:.1f} ms over {args.max_p95_ms} ms")
+    before = (baseline or {}).get("probe_p95_ms")
+    if p95 is not None and before and p95 > before * (1 + args.max_regression):
+        found.append(
+            f"probe p95 {p95:.1f} ms, {p95 / before - 1:+.0%} since {before:.1f} ms"
+        )
+    if record.get("percent_indexed", 1) < 1 or record.get("unindexed_keys"):
+        found.append(
+            f"indexing backlog: {record.get('percent_indexed', 1):.1%} indexed, "
+            f"{record['unindexed_keys']} keys not in the index"
+        )
+    if record.get("hash_indexing_failures"):
+        found.append(f"{record['hash_indexing_failures']:.0f} indexing failures")
+    if record.get("vector_index_sz_mb", 0) > args.max_vector_mb:
+        found.append(
+            f"vector index {record['vector_index_sz_mb']:.0f} MB over "
+            f"{args.max_vector_mb} MB, consider a pca profile or shards"
+        )
+    if (
+        record.get("algorithm") == "FLAT"
+        and record.get("num_docs", 0) > args.flat_max_docs
+    ):
+        found.append(
+            f"FLAT index of {record['num_docs']:.0f} docs, consider the hnsw profile"
+        )
+    if record.get("maxmemory_mb") and (
+        record["used_memory_mb"] / record["maxmemory_mb"] > args.max_memory_share
+    ):
+        found.append(
+            f"node at {record['used_memory_mb'] / record['maxmemory_mb']:.0%} of "
+            f"maxmemory, consider shards"
+        )
+    return found
+
+
+def load_baselines(path) -> dict:
+    # the first sample of every index in the time series
+    baselines = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if "error" not in record:
+                    baselines.setdefault(record["index"], record)
+    return baselines
+
+
+def show(records):
+    table = Table(
+        "index",
+        "docs",
+        "keys",
+        "memory MB",
+        "vector MB",
+        "indexed",
+        "p50 ms",
+        "p95 ms",
+        title=time.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+    for r in records:
+        if "error" in r:
+            table.add_row(r["index"], r["error"], *[""] * 6)
+            continue
+        table.add_row(
+            r["index"],
+            f"{r.get('num_docs', 0):.0f}",
+            str(r["keys"]),
+            f"{r['memory_mb']:.1f}",
+            f"{r.get('vector_index_sz_mb', 0):.1f}",
+            f"{r.get('percent_indexed', 1):.0%}",
+            f"{r.get('probe_p50_ms', 0):.2f}",
+            f"{r.get('probe_p95_ms', 0):.2f}",
+        )
+    print(table)
+    for r in records:
+        for alert in r.get("alerts", []):
+            print(f"[red]{r['index']}: {alert}[/red]")
+
+
+def targets(indexes):
+    """(label, client, index name) of everything to sample."""
+    r = get_redis_conn()
+    shards = get_shard_conns()
+    found = []
+    for name in indexes:
+        if shards and name == "movies":
+            for client in shards:
+                kwargs = client.connection_pool.connection_kwargs
+                found.append(
+                    (f"{name}@{kwargs['host']}:{kwargs['port']}", client, name)
+                )
+        else:
+            found.append((name, r, name))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sample the size, indexing and probe latency of the search indexes"
+    )
+    parser.add_argument("--indexes", nargs="+", default=["movies", "llmcache"])
+    parser.add_argument("--out", default="utils/bench_results/profile.jsonl")
+    parser.add_argument(
+        "--interval", type=float, default=60, help="Seconds between samples"
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=0,
+        help="Number of samples, 0 to run until stopped",
+    )
+    parser.add_argument(
+        "--probes", type=int, default=20, help="KNN probe queries per index"
+    )
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument(
+        "--memory-sample",
+        type=int,
+        default=200,
+        help="Keys per prefix whose MEMORY USAGE the total is estimated from",
+    )
+    parser.add_argument("--max-p95-ms", type=float, default=50)
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.5,
+        help="Alert when the probe p95 is this much over the first sample of the file",
+    )
+    parser.add_argument("--max-vector-mb", type=float, default=1024)
+    parser.add_argument("--flat-max-docs", type=int, default=100000)
+    parser.add_argument("--max-memory-share", type=float, default=0.8)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    baselines = load_baselines(args.out)
+    taken = 0
+    while True:
+        start = time.time()
+        records = []
+        for label, client, name in targets(args.indexes):
+            try:
+                record = sample_index(client, label, name, args)
+            except (ResponseError, ValueError) as e:
+                record = {"index": label, "error": str(e)}
+            record["time"] = start
+            if "error" not in record:
+                record["alerts"] = alerts(record, baselines.get(label), args)
+                baselines.setdefault(label, record)
+            records.append(record)
+
+        with open(args.out, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        show(records)
+
+        taken += 1
+        if args.samples and taken >= args.samples:
+            break
+        time.sleep(max(args.interval - (time.time() - start), 0))
+    print(f"{taken} samples appended to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from rich import print
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from sidecar_format import METADATA_FILE, prepare_metadata, write_sidecar
+from vectorizers import LOCAL_MODEL, LocalTextVectorizer
+
+# Re-embeds the whole catalogue offline with the local sentence-transformers
+# model, spread over a pool of worker processes, and writes the result as a
+# sidecar that `load_redis.py --sidecar ... --profile local` can load.
+
+_vectorizer = None
+
+
+def _init_worker(model, threads, batch_size):
+    global _vectorizer
+    import torch
+
+    # one pool process per core, so keep torch from oversubscribing the CPU
+    torch.set_num_threads(threads)
+    _vectorizer = LocalTextVectorizer(model=model, batch_size=batch_size)
+
+
+def _encode(texts):
+    return np.array(_vectorizer.embed_many(texts), dtype=np.float32)
+
+
+def read_metadata(source, chunk_size):
+    if os.path.isdir(source):
+        parquet = pq.ParquetFile(os.path.join(source, METADATA_FILE))
+        for batch in parquet.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(
+            source, chunksize=chunk_size, usecols=lambda c: c != "embedding"
+        ):
+            yield prepare_metadata(chunk)
+
+
+def embed_chunks(pool, chunks, text_field, max_pending):
+    # keeps at most max_pending chunks in flight and yields them in order
+    pending = deque()
+    for chunk in chunks:
+        texts = chunk[text_field].astype(str).tolist()
+        pending.append((chunk, pool.submit(_encode, texts)))
+        if len(pending) >= max_pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+    while pending:
+        chunk, future = pending.popleft()
+        yield chunk, future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-embed the catalogue with the local model into a sidecar"
+    )
+    parser.add_argument(
+        "--data",
+        default="utils/data_with_embeddings.csv",
+        help="The movies csv, or a sidecar directory to take the metadata from",
+    )
+    parser.add_argument("--out", default="utils/data_sidecar_local")
+    parser.add_argument("--model", default=os.getenv("local_model") or LOCAL_MODEL)
+    parser.add_argument("--text-field", default="overview")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    dims = LocalTextVectorizer(model=args.model).dims
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(args.model, args.threads_per_worker, args.batch_size),
+    ) as pool:
+        chunks = embed_chunks(
+            pool,
+            read_metadata(args.data, args.chunk_size),
+            args.text_field,
+            max_pending=2 * args.workers,
+        )
+        rows = write_sidecar(args.out, chunks, dims)
+
+    elapsed = time.time() - start_time
+    print(
+        f"Embedded {rows} movies with {args.model} ({dims} dims) in {elapsed:.2f} "
+        f"seconds ({rows / elapsed:.0f} docs/s), written to {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
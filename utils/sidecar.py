@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+
+import pandas as pd
+from rich import print
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+# the format itself lives in app/ so the app can read sidecars too
+from sidecar_format import parse_embeddings, prepare_metadata, write_sidecar
+
+
+def convert(datafile, outdir, dims=1536, chunk_size=1000):
+    def chunks():
+        for chunk in pd.read_csv(datafile, chunksize=chunk_size):
+            embeddings = parse_embeddings(chunk.pop("embedding"), dims)
+            yield prepare_metadata(chunk), embeddings
+
+    return write_sidecar(outdir, chunks(), dims)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert the movies csv to the binary sidecar format"
+    )
+    parser.add_argument("--data", default="utils/data_with_embeddings.csv")
+    parser.add_argument("--out", default="utils/data_sidecar")
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    rows = convert(args.data, args.out, dims=args.dims, chunk_size=args.chunk_size)
+    print(f"Wrote {rows} rows to {args.out} in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from rich import print
+
+# Deterministic stand-in for the OpenAI embeddings, chat completions and image
+# generation endpoints. Point the openai client at it with
+#   OPENAI_BASE_URL=http://127.0.0.1:8765 OPENAI_API_KEY=stub
+# The same input always gets the same answer, and every endpoint can be given
+# a fixed latency to mimic the real API.
+
+DEFAULT_DIMS = {"text-embedding-ada-002": 1536}
+
+GENRES = ["action", "adventure", "comedy", "drama", "fantasy", "science fiction"]
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def stub_embedding(text: str, dims: int) -> np.ndarray:
+    vector = np.random.default_rng(_seed(text)).standard_normal(dims)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def stub_movie(prompt: str) -> dict:
+    n = _seed(prompt) % 10000
+    return {
+        "original_title": f"Stub Movie {n}",
+        "overview": f"Generated overview {n}. " * 40,
+        "genres": [GENRES[n % len(GENRES)], GENRES[(n // 7) % len(GENRES)]],
+        "tagline": f"Tagline {n}",
+        "poster_desc": f"Poster of stub movie {n}",
+    }
+
+
+def stub_png(digest: str, size: int = 64) -> bytes:
+    # a solid square in a colour taken from the digest
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    row = b"\x00" + bytes.fromhex(digest[:6]) * size
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * size))
+        + chunk(b"IEND", b"")
+    )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = {}
+    dims = 1536
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+        latency = self.latency.get(endpoint, 0)
+        if not request.get("stream"):
+            time.sleep(latency)
+
+        if endpoint == "embeddings":
+            self._reply(self.embeddings(request))
+        elif endpoint == "completions" and request.get("stream"):
+            content = json.dumps(stub_movie(request["messages"][-1]["content"]))
+            self._stream(request["model"], content, latency)
+        elif endpoint == "completions":
+            content = request["messages"][-1]["content"]
+            self._reply(
+                {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {
+                                "role": "assistant",
+                                "content": json.dumps(stub_movie(content)),
+                            },
+                        }
+                    ],
+                }
+            )
+        elif endpoint == "generations":
+            digest = hashlib.sha256(request["prompt"].encode("utf-8")).hexdigest()
+            if request.get("response_format") == "b64_json":
+                image = {"b64_json": base64.b64encode(stub_png(digest)).decode("ascii")}
+            else:
+                image = {"url": f"https://stub.invalid/posters/{digest}.png"}
+            self._reply({"created": int(time.time()), "data": [image]})
+        else:
+            self.send_error(404, f"No stub for {self.path}")
+
+    def _stream(self, model, content, latency, chunk_size=16):
+        # server-sent events of chat.completion.chunk, the latency of the
+        # endpoint spread over the chunks
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [
+            content[i : i + chunk_size] for i in range(0, len(content), chunk_size)
+        ]
+        for piece in pieces + [None]:
+            time.sleep(latency / (len(pieces) + 1))
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": piece} if piece else {},
+                        "finish_reason": None if piece else "stop",
+                    }
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def embeddings(self, request):
+        texts = request["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        dims = DEFAULT_DIMS.get(request["model"], self.dims)
+        data = []
+        for i, text in enumerate(texts):
+            vector = stub_embedding(text, dims)
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(t.split()) for t in texts)
+        return {
+            "object": "list",
+            "data": data,
+            "model": request["model"],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+def serve(host="127.0.0.1", port=8765, latency=None, background=False):
+    """Start the stub server, in a daemon thread when `background` is set.
+
+    `latency` maps an endpoint (embeddings, completions, generations) to the
+    seconds each call to it should take.
+    """
+    handler = type("Handler", (StubHandler,), {"latency": dict(latency or {})})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--chat-latency", type=float, default=0.0)
+    parser.add_argument("--image-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}")
+    serve(
+        args.host,
+        args.port,
+        latency={
+            "embeddings": args.embedding_latency,
+            "completions": args.chat_latency,
+            "generations": args.image_latency,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+# Replays logged Semantic Caching prompts through a simulation of the tiered
+# prompt cache (app/prompt_cache.py) at several distance thresholds and
+# reports the hit rate and the false-hit rate of each. A poster is made for
+# the movie nearest to the prompt, so a semantic hit is false when the
+# nearest movie of the prompt differs from that of the cached prompt that
+# answered it. TTL and max-entries eviction are not simulated.
+
+
+def load_prompts(path=None, limit=5000):
+    """The last `limit` prompts of the cache log in Redis, or of `path`, one
+    prompt per line or JSONL with a "prompt" field."""
+    if path:
+        with open(path) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        prompts = [
+            json.loads(line)["prompt"] if line.startswith("{") else line
+            for line in lines
+        ]
+        return prompts[-limit:]
+
+    from prompt_cache import PROMPT_LOG
+    from resources import get_redis_conn
+
+    entries = get_redis_conn().xrevrange(PROMPT_LOG, count=limit)
+    return [fields["prompt"] for _, fields in reversed(entries)]
+
+
+def nearest_movies(vectors, batch_size=100):
+    from redisvl.query import VectorQuery
+
+    from resources import get_index, get_replica
+    from search import knn
+
+    jindex, replica = get_index(), get_replica()
+    movies = []
+    for pos in range(0, len(vectors), batch_size):
+        queries = [
+            VectorQuery(
+                vector=v,
+                vector_field_name="embedding",
+                return_fields=["original_title"],
+                num_results=1,
+            )
+            for v in vectors[pos : pos + batch_size]
+        ]
+        movies += [
+            docs[0]["id"] if docs else None for docs in knn(jindex, queries, replica)
+        ]
+    return movies
+
+
+def simulate(digests, vectors, movies, threshold):
+    """Replay the prompts in order against an initially empty cache."""
+    exact, stored, stored_movies = set(), [], []
+    exact_hits = hits = false_hits = 0
+    for digest, vector, movie in zip(digests, vectors, movies):
+        if digest in exact:
+            exact_hits += 1
+            continue
+        exact.add(digest)
+        if stored:
+            distances = 1.0 - np.asarray(stored) @ vector
+            best = int(np.argmin(distances))
+            if distances[best] <= threshold:
+                hits += 1
+                false_hits += stored_movies[best] != movie
+                continue
+        stored.append(vector)
+        stored_movies.append(movie)
+    return exact_hits, hits, false_hits, len(stored)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tune the distance threshold of the semantic cache on logged prompts"
+    )
+    parser.add_argument(
+        "--prompts", help="File of prompts to replay instead of the log in Redis"
+    )
+    parser.add_argument("--limit", type=int, default=5000)
+    parser.add_argument(
+        "--thresholds",
+        type=float,
+        nargs="+",
+        default=[0.05, 0.1, 0.15, 0.2, 0.25, 0.3],
+    )
+    parser.add_argument(
+        "--max-false-hit-rate",
+        type=float,
+        default=0.02,
+        help="Highest share of semantic hits answered with another movie's poster",
+    )
+    args = parser.parse_args()
+
+    from prompt_cache import prompt_digest
+    from resources import get_vectorizer
+
+    prompts = load_prompts(args.prompts, args.limit)
+    if not prompts:
+        raise ValueError("No prompts to replay, the cache log is empty")
+    vectors = np.array(get_vectorizer().embed_many(prompts), dtype=np.float32)
+    movies = nearest_movies(vectors.tolist())
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    digests = [prompt_digest(p) for p in prompts]
+
+    current = float(os.getenv("llmcache_distance_threshold", 0.2))
+    table = Table(
+        "threshold",
+        "hit rate",
+        "exact hits",
+        "semantic hits",
+        "false hits",
+        "false-hit rate",
+        "entries",
+        title=f"{len(prompts)} prompts, {len(set(digests))} distinct",
+    )
+    best = None
+    for threshold in sorted(args.thresholds):
+        exact_hits, hits, false_hits, entries = simulate(
+            digests, vectors, movies, threshold
+        )
+        false_rate = false_hits / hits if hits else 0.0
+        if false_rate <= args.max_false_hit_rate:
+            best = threshold
+        table.add_row(
+            f"{threshold:g}" + (" (current)" if threshold == current else ""),
+            f"{(exact_hits + hits) / len(prompts):.3f}",
+            str(exact_hits),
+            str(hits),
+            str(false_hits),
+            f"{false_rate:.3f}",
+            str(entries),
+        )
+    print(table)
+    if best is None:
+        print(f"No threshold keeps the false-hit rate under {args.max_false_hit_rate}")
+    else:
+        print(f'Suggested: llmcache_distance_threshold = "{best:g}"')
+
+
+if __name__ == "__main__":
+    main()